@@ -6,6 +6,8 @@ import xlsxwriter
 from bs4 import BeautifulSoup
 import urllib.parse
 import hashlib
+from xml.sax.saxutils import escape
+from TransmapStore import *
 
 def get_text_regex():
     exceptions = ["cm", "m", "g", "kg", "s", "min", "max", "h", "cm"]
@@ -24,6 +26,17 @@ def get_text_content_regex():
 def get_image_regex():
     return re.compile(r"((!\[(graph)?\]\()?\s*(http|https|web\+graphie):\/\/ka-perseus-(images|graphie)\.s3\.amazonaws\.com\/[0-9a-f]+(\.(svg|png|jpg))?\)?)")
 
+_formula_regex = re.compile(r"\$[^\$]+\$")
+_image_regex = get_image_regex()
+
+def normalize_ifpattern(s):
+    """
+    Replace formulas and images by §formula§ and §image§, so strings which
+    only differ in those share one pattern (see IgnoreFormulaPatternIndexer)
+    """
+    s = _formula_regex.sub("§formula§", s)
+    return _image_regex.sub("§image§", s)
+
 def transmap_filename(lang, identifier, extension="json"):
     return os.path.join("transmap", "{}.{}.{}".format(
         lang, identifier, extension))
@@ -32,7 +45,20 @@ def read_patterns(lang, identifier):
     with open(transmap_filename(lang, identifier)) as infile:
         return json.load(infile)
 
+# SQL versions of the filters in read_ifpattern_index() / read_texttag_index()
+_ifpattern_condition = "translated != '' AND " \
+    "length(english) - length(replace(english, '$formula$', '')) = " \
+    "length(translated) - length(replace(translated, '$formula$', ''))"
+_texttag_condition = "translated != '' OR english = ''"
+
 def read_ifpattern_index(lang):
+    """
+    english => translation dict of the usable IF patterns.
+    Read from the transmap store if it is up to date.
+    """
+    ifpatterns = read_transmap(lang, "ifpatterns", _ifpattern_condition)
+    if ifpatterns is not None:
+        return ifpatterns
     try:
         ifpatterns = read_patterns(lang, "ifpatterns")
         return {
@@ -45,6 +71,13 @@ def read_ifpattern_index(lang):
         return {}
 
 def read_texttag_index(lang):
+    """
+    english => translation dict of the translated text tags.
+    Read from the transmap store if it is up to date.
+    """
+    texttags = read_transmap(lang, "texttags", _texttag_condition)
+    if texttags is not None:
+        return texttags
     try:
         texttags = read_patterns(lang, "texttags")
         return {
@@ -81,6 +114,94 @@ def pattern_list_to_xliff(patterns):
         body.append(trans)
     return soup
 
+class XLIFFPatternWriter(object):
+    """
+    Writes patterns into a XLIFF file one trans-unit at a time.
+    Same output as pattern_list_to_xliff() without building the document tree.
+    """
+    def __init__(self, filename):
+        with open("template.xliff") as infile:
+            template = infile.read()
+        body_end = template.index("</body>")
+        self._suffix = template[body_end:]
+        self._outfile = open(filename, "w")
+        self._outfile.write(template[:body_end])
+
+    def write(self, pattern):
+        state = "needs-translations" if pattern["translated"] == "" else "translated"
+        self._outfile.write('<trans-unit><source>{}</source><target state="{}">{}</target></trans-unit>'.format(
+            escape(pattern["english"]), state,
+            escape(pattern["translated"] if pattern["translated"] else pattern["english"])))
+
+    def close(self):
+        self._outfile.write(self._suffix)
+        self._outfile.close()
+
+class JSONListWriter(object):
+    """
+    Writes a JSON list one item at a time.
+    Same output as json.dump(items, outfile, indent=4, sort_keys=True)
+    """
+    def __init__(self, filename):
+        self._outfile = open(filename, "w")
+        self._count = 0
+
+    def write(self, item):
+        self._outfile.write("[\n    " if self._count == 0 else ",\n    ")
+        self._outfile.write(json.dumps(item, indent=4, sort_keys=True).replace("\n", "\n    "))
+        self._count += 1
+
+    def close(self):
+        self._outfile.write("\n]" if self._count else "[]")
+        self._outfile.close()
+
+class XLSXPatternWriter(object):
+    """
+    Writes patterns into a XLSX file one row at a time.
+    Uses the xlsxwriter constant memory mode, so rows are flushed to disk immediately.
+    """
+    def __init__(self, filename):
+        self._workbook = xlsxwriter.Workbook(filename, {"constant_memory": True})
+        self._worksheet = self._workbook.add_worksheet()
+        # Header
+        self._worksheet.write(0, 0, "Count")
+        self._worksheet.write(0, 1, "Untranslated count")
+        self._worksheet.write(0, 2, "English")
+        self._worksheet.write(0, 3, "Translated")
+        self._row = 1
+
+    def write(self, tag):
+        self._worksheet.write(self._row, 0, tag["count"])
+        self._worksheet.write(self._row, 1, tag["untranslated_count"])
+        self._worksheet.write(self._row, 2, tag["english"])
+        self._worksheet.write(self._row, 3, tag["translated"])
+        self._row += 1
+
+    def close(self):
+        self._workbook.close()
+
+def export_patterns(lang, identifier, patterns):
+    """
+    Write patterns (any iterable, e.g. a generator) in a single pass to
+    transmap/<lang>.<identifier>.json, .untranslated.json, .xliff and .xlsx
+    and to the transmap store
+    """
+    json_writer = JSONListWriter(transmap_filename(lang, identifier))
+    untranslated_writer = JSONListWriter(transmap_filename(lang, identifier + ".untranslated"))
+    xliff_writer = XLIFFPatternWriter(transmap_filename(lang, identifier, "xliff"))
+    xlsx_writer = XLSXPatternWriter(transmap_filename(lang, identifier, "xlsx"))
+    store_writer = TransmapStoreWriter(lang, identifier)
+    for pattern in patterns:
+        json_writer.write(pattern)
+        if not pattern["translated"]:
+            untranslated_writer.write(pattern)
+        xliff_writer.write(pattern)
+        xlsx_writer.write(pattern)
+        store_writer.write(pattern)
+    # Store last: It is only used if it is at least as new as the JSON file
+    for writer in (json_writer, untranslated_writer, xliff_writer, xlsx_writer, store_writer):
+        writer.close()
+
 def to_crowdin_search_string(entry):
     s = entry.translated[:100].replace('*', ' ')
     s = s.replace('$', ' ').replace('\\', ' ').replace(',', ' ')
@@ -91,23 +212,10 @@ def to_crowdin_search_string(entry):
     return urllib.parse.quote(s.replace('☃', ' ').replace("|", " "))
 
 def to_xlsx(tags, filename):
-    workbook = xlsxwriter.Workbook(filename)
-    worksheet = workbook.add_worksheet()
-
-    # Header
-    worksheet.write(0, 0, "Count")
-    worksheet.write(0, 1, "Untranslated count")
-    worksheet.write(0, 2, "English")
-    worksheet.write(0, 3, "Translated")
-
-    # Content
-    for i, tag in enumerate(tags):
-        worksheet.write(i + 1, 0, tag["count"])
-        worksheet.write(i + 1, 1, tag["untranslated_count"])
-        worksheet.write(i + 1, 2, tag["english"])
-        worksheet.write(i + 1, 3, tag["translated"])
-
-    workbook.close()
+    writer = XLSXPatternWriter(filename)
+    for tag in tags:
+        writer.write(tag)
+    writer.close()
 
 def from_xlsx(tags, filename):
     workbook = xlsxwriter.Workbook(filename)
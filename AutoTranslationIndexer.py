@@ -6,10 +6,234 @@ from toolz.dicttoolz import valmap
 from AutoTranslationTranslator import RuleAutotranslator
 import os
 import json
+import array
+import hashlib
+import numpy as np
 from bs4 import BeautifulSoup
 from UpdateAllFiles import getTranslationFilemapCache
 from AutoTranslateCommon import *
 
+def merge_counter_index(index, other, remap=None):
+    """
+    Add a defaultdict(Counter) index to another one.
+    New keys are appended, so merging shards in order keeps the order
+    (and therefore the most_common() ties) of sequential indexing.
+    remap maps the inner keys (file IDs) of other to those of index (see FileTable.remap()).
+    """
+    for key, counter in other.items():
+        if remap is None:
+            index[key].update(counter)
+        else:
+            target = index[key]
+            for file_id, count in counter.items():
+                target[remap[file_id]] += count
+
+def subtract_counter(counter, other):
+    """
+    Subtract the counts of other from a Counter, removing keys which drop to zero.
+    Used to remove the contribution of a shard from an index.
+    """
+    for key, count in other.items():
+        remaining = counter[key] - count
+        if remaining > 0:
+            counter[key] = remaining
+        else:
+            counter.pop(key, None)
+
+def subtract_counter_index(index, other, remap=None):
+    """Like subtract_counter() for a defaultdict(Counter) index"""
+    for key, counter in other.items():
+        if key in index:
+            if remap is not None:
+                counter = {remap[file_id]: count for file_id, count in counter.items()}
+            subtract_counter(index[key], counter)
+            if not index[key]:
+                del index[key]
+
+class FileTable(object):
+    """
+    Interns filenames to small integer IDs (assigned in order of first use),
+    so the filename indices don't need to store and export the full paths.
+    Exported as transmap/<lang>.files.json (list of filenames, index = ID).
+    """
+    def __init__(self, filenames=()):
+        self.filenames = []
+        self.ids = {}
+        for filename in filenames:
+            self.id(filename)
+
+    def id(self, filename):
+        file_id = self.ids.get(filename)
+        if file_id is None:
+            file_id = self.ids[filename] = len(self.filenames)
+            self.filenames.append(filename)
+        return file_id
+
+    def remap(self, other):
+        """List which maps the IDs of another table to the IDs in this table"""
+        return [self.id(filename) for filename in other.filenames]
+
+    def compact(self, used_ids):
+        """
+        Remove the files whose IDs are not in used_ids, e.g. files which
+        have been removed from an incremental index. The remaining files are
+        sorted by filename, so the IDs don't depend on the order of indexing
+        (e.g. the batches of a parallel run). Returns a dict which maps the
+        old IDs to the new ones.
+        """
+        filenames = self.filenames
+        self.__init__(sorted(filenames[file_id] for file_id in used_ids))
+        return {file_id: self.ids[filenames[file_id]] for file_id in used_ids}
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def __getstate__(self):
+        return self.filenames
+
+    def __setstate__(self, filenames):
+        self.__init__(filenames)
+
+    def exportJSON(self, lang):
+        with open(transmap_filename(lang, "files"), "w") as outfile:
+            json.dump(self.filenames, outfile, indent=4)
+
+def remap_counter_index(index, remap):
+    """Replace the inner keys (file IDs) of a defaultdict(Counter) index in place"""
+    for key, counter in index.items():
+        index[key] = Counter({remap[file_id]: count for file_id, count in counter.items()})
+
+def files_to_json(counter):
+    """Export a file ID => count Counter as a compact [[file ID, count], ...] list"""
+    return [[file_id, count] for file_id, count in sorted(counter.items())]
+
+class HashCounter(object):
+    """
+    Counter for 4-byte hashes (as returned by hash_string()) backed by an
+    open-addressing hash table of uint32 keys and counts (count 0 = empty slot).
+
+    add() only appends to a buffer. Buffered hashes are counted in vectorized
+    batches once the buffer is full or before the counter is accessed.
+    """
+    def __init__(self, capacity=1024, buffer_size=65536):
+        self._allocate(capacity)
+        self.buffer_size = buffer_size
+        self._buffer = bytearray()
+
+    def _allocate(self, min_capacity):
+        # Power of two capacity, so the slot is the lower bits of the key
+        capacity = 1 << max(int(min_capacity) - 1, 1).bit_length()
+        self.keys = np.zeros(capacity, dtype=np.uint32)
+        self.counts = np.zeros(capacity, dtype=np.uint32)
+        self.size = 0
+
+    def add(self, h):
+        self._buffer += h
+        if len(self._buffer) >= 4 * self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            keys, counts = np.unique(np.frombuffer(self._buffer, dtype="<u4"), return_counts=True)
+            self._buffer = bytearray()
+            self._insert(keys, counts.astype(np.uint32))
+
+    def _insert(self, keys, counts):
+        """Add counts for unique keys"""
+        if 2 * (self.size + len(keys)) > len(self.keys):
+            self._resize(2 * (self.size + len(keys)))
+        mask = len(self.keys) - 1
+        slots = (keys & mask).astype(np.int64)
+        while len(keys):
+            occupied = self.counts[slots] != 0
+            done = occupied & (self.keys[slots] == keys)
+            self.counts[slots[done]] += counts[done]
+            # Empty slots: The first key probing a slot gets it, the others try again
+            empty = np.flatnonzero(~occupied)
+            claimed = empty[np.unique(slots[empty], return_index=True)[1]]
+            self.keys[slots[claimed]] = keys[claimed]
+            self.counts[slots[claimed]] = counts[claimed]
+            self.size += len(claimed)
+            done[claimed] = True
+            # Linear probing for keys whose slot is taken by another key
+            slots[occupied] = (slots[occupied] + 1) & mask
+            keys, counts, slots = keys[~done], counts[~done], slots[~done]
+
+    def _resize(self, min_capacity):
+        keys, counts = self.items()
+        self._allocate(min_capacity)
+        self._insert(keys, counts)
+
+    def items(self):
+        """Arrays of all (keys, counts)"""
+        self.flush()
+        occupied = self.counts != 0
+        return self.keys[occupied], self.counts[occupied]
+
+    def merge(self, other):
+        self.flush()
+        self._insert(*other.items())
+
+    def filter(self, min_count):
+        """New HashCounter with the keys having at least min_count instances"""
+        keys, counts = self.items()
+        keep = counts >= min_count
+        result = HashCounter(capacity=2 * max(int(keep.sum()), 512))
+        result._insert(keys[keep], counts[keep])
+        return result
+
+    def __getitem__(self, h):
+        if self._buffer:
+            self.flush()
+        keys, counts = self.keys, self.counts
+        key = int.from_bytes(h, "little")
+        mask = len(keys) - 1
+        slot = key & mask
+        while counts[slot]:
+            if keys[slot] == key:
+                return int(counts[slot])
+            slot = (slot + 1) & mask
+        return 0
+
+    def __contains__(self, h):
+        return self[h] != 0
+
+    def __len__(self):
+        self.flush()
+        return self.size
+
+
+class CountMinSketch(object):
+    """
+    Count-min sketch (with conservative update) over saturating byte counters.
+    Estimates are never lower than the true count (below max_count) and exceed
+    it by more than e / width * (total number of counted keys)
+    with a probability of at most exp(-depth).
+    """
+    max_count = 255
+
+    def __init__(self, width=2**22, depth=4):
+        self.width = width
+        self.depth = depth
+        self.counts = array.array("B", bytes(width * depth))
+
+    def _cells(self, key):
+        digest = hashlib.blake2b(key, digest_size=4 * self.depth).digest()
+        return [row * self.width + int.from_bytes(digest[4 * row:4 * row + 4], "little") % self.width
+                for row in range(self.depth)]
+
+    def add(self, key):
+        """Count the given key (bytes) and return its new estimated count"""
+        cells = self._cells(key)
+        estimate = min(self.counts[cell] for cell in cells)
+        if estimate < self.max_count:
+            estimate += 1
+            # Conservative update: Only increment the counters which are too low
+            for cell in cells:
+                if self.counts[cell] < estimate:
+                    self.counts[cell] = estimate
+        return estimate
+
 class CompositeIndexer(object):
     """
     Utility that calls add() once for every child object.
@@ -32,14 +256,55 @@ class CompositeIndexer(object):
         for child in self.children:
             child.clean_preindex(*args, **kwargs)
 
+    def new_shard(self):
+        # Like the top-level indexers, the children of a shard share one file table
+        files = FileTable()
+        return CompositeIndexer(*(child.new_shard(files=files) for child in self.children))
+
+    def merge(self, other):
+        for child, other_child in zip(self.children, other.children):
+            child.merge(other_child)
+
+    def subtract(self, other):
+        for child, other_child in zip(self.children, other.children):
+            child.subtract(other_child)
+
+    def counters(self):
+        return [child.counters() for child in self.children]
+
+    def compact_files(self):
+        """
+        Drop the files which are not referenced by any filename index anymore
+        (e.g. after subtract()) from the file tables of the children
+        and assign the file IDs in filename order
+        """
+        tables = {}
+        for child in self.children:
+            tables.setdefault(id(child.files), (child.files, []))[1].append(child)
+        for files, children in tables.values():
+            remap = files.compact(set().union(*(child.filename_index_ids() for child in children)))
+            for child in children:
+                remap_counter_index(child.filename_index, remap)
+
+    def from_counters(self, counters):
+        return CompositeIndexer(*(child.from_counters(child_counters)
+            for child, child_counters in zip(self.children, counters)))
+
 
 class TextTagIndexer(object):
-    def __init__(self, lang):
+    """
+    Indexes the content of \\text{...} tags.
+
+    Indices can be built in parallel: new_shard() creates an empty indexer
+    with the same configuration and merge() adds a shard to this indexer.
+    """
+    def __init__(self, lang, files=None):
         self.lang = lang
         self.index = Counter() # TOTAL count for each text tag
         self.untranslated_index = Counter()
         self.translated_index = defaultdict(Counter)
-        self.filename_index = defaultdict(Counter) # norm_engl => {filename: count}
+        self.files = FileTable() if files is None else files
+        self.filename_index = defaultdict(Counter) # norm_engl => {file ID: count}
         self._re = get_text_content_regex()
 
     def add(self, engl, translated=None, filename=None):
@@ -64,16 +329,49 @@ class TextTagIndexer(object):
                 self.index[engl_hit] += 1
                 self.untranslated_index[engl_hit] += 1
                 # Count occurrences in files
-                self.filename_index[engl_hit][filename] += 1
+                self.filename_index[engl_hit][self.files.id(filename)] += 1
         #except Exception as ex:
         #    print(red("Failed to index '{}' --> {}: {}".format(engl, translated, ex) bold=True))
 
     def __len__(self):
         return len(self.index)
 
-    def _convert_to_json(self, ignore_alltranslated=False):
-        texttags = []
-        # Sort by most untranslated
+    def new_shard(self, files=None):
+        return TextTagIndexer(self.lang, files=files)
+
+    def merge(self, other):
+        self.index.update(other.index)
+        self.untranslated_index.update(other.untranslated_index)
+        merge_counter_index(self.translated_index, other.translated_index)
+        merge_counter_index(self.filename_index, other.filename_index,
+            self.files.remap(other.files))
+
+    def subtract(self, other):
+        """Remove a shard which has previously been merged"""
+        subtract_counter(self.index, other.index)
+        subtract_counter(self.untranslated_index, other.untranslated_index)
+        subtract_counter_index(self.translated_index, other.translated_index)
+        subtract_counter_index(self.filename_index, other.filename_index,
+            self.files.remap(other.files))
+
+    def filename_index_ids(self):
+        """The IDs of all files referenced by the filename index"""
+        return {file_id for counter in self.filename_index.values() for file_id in counter}
+
+    def counters(self):
+        """The counters which make up the index, e.g. for persisting a shard"""
+        return (self.index, self.untranslated_index, self.translated_index,
+                self.filename_index, self.files)
+
+    def from_counters(self, counters):
+        """New shard with the given counters (see counters())"""
+        shard = self.new_shard()
+        (shard.index, shard.untranslated_index, shard.translated_index,
+         shard.filename_index, shard.files) = counters
+        return shard
+
+    def _iter_patterns(self, ignore_alltranslated=False):
+        """Generate the export entries, sorted by most untranslated"""
         for (hit, count) in self.untranslated_index.most_common():
             total_count = self.index[hit]
             untransl_count = self.untranslated_index[hit]
@@ -82,12 +380,11 @@ class TextTagIndexer(object):
             # Get the most common translation for that tag
             transl = "" if len(self.translated_index[hit]) == 0 \
                 else self.translated_index[hit].most_common(1)[0][0]
-            texttags.append({"english": hit,
+            yield {"english": hit,
                 "translated": transl, "count": total_count,
                 "untranslated_count": untransl_count,
-                    "files": self.filename_index[hit],
-                "type": "texttag"})
-        return texttags
+                    "files": files_to_json(self.filename_index[hit]),
+                "type": "texttag"}
 
     def preindex(self, *args, **kwargs):
         pass
@@ -95,58 +392,124 @@ class TextTagIndexer(object):
     def clean_preindex(self, *args, **kwargs):
         pass
 
-    def exportJSON(self, ignore_alltranslated=False):
-        texttags = self._convert_to_json(ignore_alltranslated)
-        # Export main patterns file
-        with open(transmap_filename(self.lang, "texttags"), "w") as outfile:
-            json.dump(texttags, outfile, indent=4, sort_keys=True)
-
-        # export file of untranslated patterns
-        with open(transmap_filename(self.lang, "texttags.untranslated"), "w") as outfile:
-            json.dump(list(filter(lambda p: not p["translated"], texttags)),
-                outfile, indent=4, sort_keys=True)
-
-    def exportXLIFF(self, ignore_alltranslated=False):
-        texttags = self._convert_to_json(ignore_alltranslated)
-        soup = pattern_list_to_xliff(texttags)
-        with open(transmap_filename(self.lang, "texttags", "xliff"), "w") as outfile:
-            outfile.write(str(soup))
-
-    def exportXLSX(self, ignore_alltranslated=False):
-        texttags = self._convert_to_json(ignore_alltranslated)
-        filename = transmap_filename(self.lang, "texttags", "xlsx")
-        to_xlsx(texttags, filename)
+    def export(self, ignore_alltranslated=False):
+        """Export JSON, untranslated JSON, XLIFF and XLSX in a single pass"""
+        export_patterns(self.lang, "texttags", self._iter_patterns(ignore_alltranslated))
 
 class IgnoreFormulaPatternIndexer(object):
     """
     Indexes patterns with only the text as key, replacing all formulas with §formula§
+
+    Supports new_shard() / merge() like TextTagIndexer.
+
+    By default, a preindex pass over all files is required before add()
+    (see clean_preindex()). With single_pass=True, patterns are admitted
+    online instead: Occurrences are counted in a CountMinSketch and kept in a
+    pending list until the pattern has been seen preindex_min_count times,
+    at which point they are replayed into the index. At most max_pending
+    occurrences are kept (per shard). If more are dropped, the count of a
+    pattern can be too low by up to preindex_min_count - 1 for every shard.
+
+    With unfiltered=True, all patterns are indexed without any preindex.
+    The index of a file then does not depend on the other files (see IndexCache).
+    Non-patterns are still removed on export.
     """
-    def __init__(self, lang):
+    def __init__(self, lang, texttags=None, single_pass=False, sketch_width=2**22, max_pending=1000000, unfiltered=False, files=None):
         self.lang = lang
         self.autotrans = RuleAutotranslator()
         # Preindex filter
         # Used to avoid indexing patterns with one instance
-        self.preindex_ctr = Counter() # norm engl hash => count
+        self.preindex_ctr = HashCounter() # norm engl hash => count
         self.preindex_min_count = 2 # minimum instances to be considered a pattern
-        self.preindex_set = set() # Compiled from preindex_ctr in clean_preindex()
+        self.preindex_set = HashCounter() # Filtered preindex_ctr, compiled in clean_preindex()
+        # Single pass admission
+        self.single_pass = single_pass
+        self.sketch_width = sketch_width
+        self.max_pending = max_pending
+        self.sketch = None # CountMinSketch, allocated on first use
+        self.admitted = set() # norm engl hashes with at least preindex_min_count instances
+        self.pending = {} # norm engl hash => [(engl, translated, filename)] of not yet admitted patterns
+        self.num_pending = 0
+        self.pending_dropped = 0
+        self.unfiltered = unfiltered
 
         self.index = Counter() # norm engl => count
         self.untranslated_index = Counter() # norm engl => count
         self.translated_index = defaultdict(Counter) # norm engl => translation => count
-        self.filename_index = defaultdict(Counter) # norm_engl => {filename: count}
-        self._formula_re = re.compile(r"\$[^\$]+\$")
-        self._img_re = get_image_regex()
+        self.files = FileTable() if files is None else files
+        self.filename_index = defaultdict(Counter) # norm_engl => {file ID: count}
         self._text = get_text_content_regex()
         self._transURLs = {} # Translation URL examples
         # NOTE: Need to run indexer TWO TIMES to get accurate results
         # as the text tags first need to be updated to get an accurate IF index
-        self.texttags = read_texttag_index(lang)
+        self.texttags = read_texttag_index(lang) if texttags is None else texttags
         # Ignore specific whitelisted texts which are not translated
 
-    def _normalize(self, engl):
-        normalized_engl = self._formula_re.sub("§formula§", engl)
-        normalized_engl = self._img_re.sub("§image§", normalized_engl)
-        return normalized_engl
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The sketch only admits patterns within one process. Shards are
+        # combined using the admitted set and the pending lists instead.
+        state["sketch"] = None
+        return state
+
+    def new_shard(self, files=None):
+        """Empty indexer sharing the text tags and the cleaned preindex"""
+        shard = IgnoreFormulaPatternIndexer(self.lang, self.texttags,
+            self.single_pass, self.sketch_width, self.max_pending, self.unfiltered,
+            files=files)
+        shard.preindex_min_count = self.preindex_min_count
+        shard.preindex_set = self.preindex_set
+        return shard
+
+    def merge(self, other):
+        if self.single_pass:
+            # Replay the pending occurrences of patterns which were admitted by the
+            # other shard or which only have enough instances in both shards together.
+            # This is done first to keep the order of the occurrences.
+            self.admitted |= other.admitted
+            for h in list(self.pending):
+                if h in self.admitted or len(self.pending[h]) + \
+                        len(other.pending.get(h, [])) >= self.preindex_min_count:
+                    self.admitted.add(h)
+                    self._replay_pending(h)
+        self.preindex_ctr.merge(other.preindex_ctr)
+        self.index.update(other.index)
+        self.untranslated_index.update(other.untranslated_index)
+        merge_counter_index(self.translated_index, other.translated_index)
+        merge_counter_index(self.filename_index, other.filename_index,
+            self.files.remap(other.files))
+        if self.single_pass:
+            self.pending_dropped += other.pending_dropped
+            for h, entries in other.pending.items():
+                for engl, translated, filename in entries:
+                    if h in self.admitted:
+                        self._index(normalize_ifpattern(engl), engl, translated, filename)
+                    else:
+                        self._add_pending(h, (engl, translated, filename))
+
+    def subtract(self, other):
+        """Remove a shard which has previously been merged (unfiltered mode only)"""
+        subtract_counter(self.index, other.index)
+        subtract_counter(self.untranslated_index, other.untranslated_index)
+        subtract_counter_index(self.translated_index, other.translated_index)
+        subtract_counter_index(self.filename_index, other.filename_index,
+            self.files.remap(other.files))
+
+    def filename_index_ids(self):
+        """The IDs of all files referenced by the filename index"""
+        return {file_id for counter in self.filename_index.values() for file_id in counter}
+
+    def counters(self):
+        """The counters which make up the index, e.g. for persisting a shard"""
+        return (self.index, self.untranslated_index, self.translated_index,
+                self.filename_index, self.files)
+
+    def from_counters(self, counters):
+        """New shard with the given counters (see counters())"""
+        shard = self.new_shard()
+        (shard.index, shard.untranslated_index, shard.translated_index,
+         shard.filename_index, shard.files) = counters
+        return shard
 
     def preindex(self, engl, translated=None, filename=None):
         """
@@ -155,39 +518,55 @@ class IgnoreFormulaPatternIndexer(object):
         (only regarding hash collision)
         and also maintains an exact count of strings by
         """
-        normalized_engl = self._normalize(engl)
+        normalized_engl = normalize_ifpattern(engl)
         h = hash_string(normalized_engl)
-        self.preindex_ctr[h] += 1
+        self.preindex_ctr.add(h)
 
     def clean_preindex(self):
         """
-        Remove patterns with too few instances from the preindex, 
-        compiling:
-
-        - preindex_ctr with a minimum number of hits
-        - preindex_set: A set of hashes, which is fast to check for "x in set"
+        Remove patterns with too few instances from the preindex,
+        compiling preindex_set: The hashes with a minimum number of hits.
+        The counter is filtered in one vectorized step.
         """
-        todelete = []
-        # Find hits to delete
-        for (hit, count) in self.preindex_ctr.most_common():
-            if count < self.preindex_min_count:
-                todelete.append(hit)
-            else: # Will keep - add to fast set
-                self.preindex_set.add(hit)
+        total = len(self.preindex_ctr)
+        self.preindex_set = self.preindex_ctr.filter(self.preindex_min_count)
+        self.preindex_ctr = HashCounter()
         # Log
         print("Cleaning preindex: Removing {} of {} entries - {} left".format(
-            len(todelete), len(self.preindex_ctr), len(self.preindex_set)))
-        # Delete all
-        for todel in todelete:
-            del self.preindex_ctr[todel]
-        
+            total - len(self.preindex_set), total, len(self.preindex_set)))
+
+    def _add_pending(self, h, entry):
+        if self.num_pending < self.max_pending:
+            self.pending.setdefault(h, []).append(entry)
+            self.num_pending += 1
+        else:
+            self.pending_dropped += 1
+
+    def _replay_pending(self, h):
+        entries = self.pending.pop(h, [])
+        self.num_pending -= len(entries)
+        for engl, translated, filename in entries:
+            self._index(normalize_ifpattern(engl), engl, translated, filename)
 
     def add(self, engl, translated=None, filename=None):
-        normalized_engl = self._normalize(engl)
-        # Check if present in preindex. If not, its not worth investigating this string any more
+        normalized_engl = normalize_ifpattern(engl)
         h = hash_string(normalized_engl)
-        if h not in self.preindex_set:
+        if self.single_pass:
+            if h not in self.admitted:
+                if self.sketch is None:
+                    self.sketch = CountMinSketch(self.sketch_width)
+                if self.sketch.add(h) < self.preindex_min_count:
+                    # Not a pattern (yet). Keep it for when it becomes one.
+                    self._add_pending(h, (engl, translated, filename))
+                    return None
+                self.admitted.add(h)
+                self._replay_pending(h)
+        # Check if present in preindex. If not, its not worth investigating this string any more
+        elif not self.unfiltered and h not in self.preindex_set:
             return None
+        self._index(normalized_engl, engl, translated, filename)
+
+    def _index(self, normalized_engl, engl, translated=None, filename=None):
         # Index pattern if it contains TRANSLATABLE text tags ONLY.
         # The translation itself will be perfomed in the autotranslator,
         # while the text tag content itself is indexed in the texttag indexer
@@ -202,16 +581,14 @@ class IgnoreFormulaPatternIndexer(object):
         #"{}#q={}".format(self.translationURLs[filename], to_crowdin_search_string(entry))
         # Track translation for majority selection later
         if translated is not None: # translated
-            normalized_trans = self._formula_re.sub("§formula§", translated)
-            normalized_trans = self._img_re.sub("§image§", normalized_trans)
+            normalized_trans = normalize_ifpattern(translated)
             self.translated_index[normalized_engl][normalized_trans] += 1
         else: # untranslated
             self.untranslated_index[normalized_engl] += 1
-            self.filename_index[normalized_engl][filename] += 1
+            self.filename_index[normalized_engl][self.files.id(filename)] += 1
 
-    def _convert_to_json(self, ignore_alltranslated=False):
-        ifpatterns = []
-        # Sort by most untranslated
+    def _iter_patterns(self, ignore_alltranslated=False):
+        """Generate the export entries, sorted by most untranslated"""
         for (hit, count) in self.untranslated_index.most_common():
             total_count = self.index[hit]
             untransl_count = self.untranslated_index[hit]
@@ -221,35 +598,15 @@ class IgnoreFormulaPatternIndexer(object):
             transl = "" if len(self.translated_index[hit]) == 0 \
                 else self.translated_index[hit].most_common(1)[0][0]
             if total_count >= self.preindex_min_count:  # Ignore non-patterns
-                ifpatterns.append({"english": hit,
+                yield {"english": hit,
                     "translated": transl, "count": total_count,
                     "untranslated_count": untransl_count,
-                    "files": self.filename_index[hit],
-                    "type": "ifpattern"})
-        return ifpatterns
-
-
-    def exportJSON(self, ignore_alltranslated=False):
-        ifpatterns = self._convert_to_json(ignore_alltranslated)
-        # Export main patterns file
-        with open(transmap_filename(self.lang, "ifpatterns"), "w") as outfile:
-            json.dump(ifpatterns, outfile, indent=4, sort_keys=True)
-
-        # export file of untranslated patterns
-        with open(transmap_filename(self.lang, "ifpatterns.untranslated"), "w") as outfile:
-            json.dump(list(filter(lambda p: not p["translated"], ifpatterns)),
-                outfile, indent=4, sort_keys=True)
-
-    def exportXLIFF(self, ignore_alltranslated=False):
-        ifpatterns = self._convert_to_json(ignore_alltranslated)
-        soup = pattern_list_to_xliff(ifpatterns)
-        with open(transmap_filename(self.lang, "ifpatterns", "xliff"), "w") as outfile:
-            outfile.write(str(soup))
-
-    def exportXLSX(self, ignore_alltranslated=False):
-        iftags = self._convert_to_json(ignore_alltranslated)
-        filename = transmap_filename(self.lang, "ifpatterns", "xlsx")
-        to_xlsx(iftags, filename)
+                    "files": files_to_json(self.filename_index[hit]),
+                    "type": "ifpattern"}
+
+    def export(self, ignore_alltranslated=False):
+        """Export JSON, untranslated JSON, XLIFF and XLSX in a single pass"""
+        export_patterns(self.lang, "ifpatterns", self._iter_patterns(ignore_alltranslated))
 
 
 class GenericPatternIndexer(object):
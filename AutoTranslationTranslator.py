@@ -6,27 +6,106 @@ import os.path
 import json
 import itertools
 import random
+import hashlib
+import sqlite3
+import threading
+import functools
 from toolz.dicttoolz import merge
 from AutoTranslateCommon import *
 from googletrans import Translator
 
 import requests
 
+def config_hash(*parts):
+    """Short hash of a translator configuration, for cache_key"""
+    return hashlib.md5(repr(parts).encode("utf-8")).hexdigest()[:16]
+
+def regex_patterns(obj):
+    """The patterns of all compiled regexes stored as attributes of obj"""
+    return sorted(value.pattern for value in vars(obj).values()
+                  if hasattr(value, "pattern"))
+
+class TranslationResultStore(object):
+    """
+    On-disk cache of translation results (SQLite), shared between runs and
+    languages. Results are stored per translator chain (see
+    CompositeAutoTranslator). Untranslatable strings are stored as NULL.
+    """
+    def __init__(self, filename, chain, commit_every=1000):
+        self.chain = chain
+        self.commit_every = commit_every
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS results (
+            chain TEXT NOT NULL, english TEXT NOT NULL, translated TEXT,
+            PRIMARY KEY (chain, english)) WITHOUT ROWID""")
+
+    def get(self, engl):
+        """Returns (True, result) if there is a stored result, else (False, None)"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT translated FROM results WHERE chain = ? AND english = ?",
+                (self.chain, engl)).fetchone()
+        return (False, None) if row is None else (True, row[0])
+
+    def put(self, engl, result):
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                (self.chain, engl, result))
+            self._uncommitted += 1
+            if self._uncommitted >= self.commit_every:
+                self._connection.commit()
+                self._uncommitted = 0
+
+    def close(self):
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
 class CompositeAutoTranslator(object):
     """
     Utility that calls tries all autoindexers until one is able to translate
     the string.
+
+    Results (including None = untranslatable) are memoized in a LRU cache
+    of cache_size strings. If result_cache is the filename of a
+    TranslationResultStore, results are also stored on disk, keyed by the
+    cache_key of all children. Translators with cache_key None (e.g. the
+    full auto translator) disable the on-disk cache.
     """
-    def __init__(self, *args):
+    def __init__(self, *args, cache_size=65536, result_cache=None):
         self.children = list(filter(lambda arg: arg is not None, args))
+        self._cached_translate = functools.lru_cache(maxsize=cache_size)(self._translate)
+        keys = [getattr(child, "cache_key", None) for child in self.children]
+        self.store = None
+        if result_cache is not None and self.children and None not in keys:
+            self.store = TranslationResultStore(result_cache, config_hash(*keys))
 
     def translate(self, engl):
+        return self._cached_translate(engl)
+
+    def _translate(self, engl):
+        if self.store is not None:
+            found, result = self.store.get(engl)
+            if found:
+                return result
+        result = self._translate_children(engl)
+        if self.store is not None:
+            self.store.put(engl, result)
+        return result
+
+    def _translate_children(self, engl):
         for child in self.children:
             result = child.translate(engl)
             if result is not None:  # Could translate
                 return result
         return None
 
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+
 class RuleAutotranslator(object):
     """
     Auto-translates based on regex rules.
@@ -52,8 +131,31 @@ class RuleAutotranslator(object):
         self._is_input = re.compile(r"^\[\[\s*☃\s*[a-z-]+\s*\d*\s*\]\](\s|\\n)*$", re.UNICODE)
         self._is_formula_plus_input = re.compile(r"^(>|#)*[\s\*]*(\$[^\$]+\$(\s|\\n|\*)*)+=?\s*\[\[\s*☃\s*[a-z-]+\s*\d*\s*\]\](\s|\\n)*$", re.UNICODE);
         self._is_simple_coordinate = re.compile(r"^[\[\(]-?\d+,-?\d+[\]\)]$")
+        # All rules in one alternation, so translate() needs a single match.
+        # The rules which always autotranslate come first. The formula rule
+        # only matches if none of them did and still requires the \text check.
+        self._classifier = re.compile("|".join(
+            ["(?:{})".format(regex.pattern) for regex in (
+                self._is_perseus_img_url, self._is_formula_plus_img, self._is_input,
+                self._is_formula_plus_input, self._is_simple_coordinate)] +
+            ["(?P<formula>{})".format(self._is_formula.pattern)]))
+
+    @property
+    def cache_key(self):
+        return "rule:" + config_hash(*regex_patterns(self))
 
     def translate(self, engl):
+        match = self._classifier.match(engl)
+        if match is None:
+            return None
+        if match.group("formula") is None or not self._contains_text.search(engl):
+            return engl
+
+    def reference_translate(self, engl):
+        """
+        Evaluates every rule separately. Equivalent to translate(),
+        which is checked against it by the tests and the benchmark.
+        """
         is_formula = self._is_formula.match(engl) is not None
         contains_text = self._contains_text.search(engl) is not None
         is_perseus_img_url = self._is_perseus_img_url.match(engl) is not None
@@ -81,10 +183,19 @@ class IFPatternAutotranslator(object):
         self._img_re = get_image_regex()
         self._text = get_text_content_regex()
 
+    @property
+    def cache_key(self):
+        # The results depend on the current pattern indices
+        versions = [(filename, os.path.getmtime(filename))
+            for filename in (transmap_filename(self.lang, "ifpatterns"),
+                             transmap_filename(self.lang, "texttags"),
+                             transmap_store_filename(self.lang))
+            if os.path.exists(filename)]
+        return "ifpattern:{}:{}".format(self.lang, config_hash(*regex_patterns(self), *versions))
+
     def translate(self, engl):
         # Normalize and filter out formulae with translatable text
-        normalized = self._formula_re.sub("§formula§", engl)
-        normalized = self._img_re.sub("§image§", normalized)
+        normalized = normalize_ifpattern(engl)
         # Mathrm is a rare alternative to \\text which is unhanled at the moment
         if "mathrm" in engl:
             return None
@@ -92,16 +203,18 @@ class IFPatternAutotranslator(object):
         texttag_replace = {} # texttags: engl full tag to translated full tag 
         for text_hit in self._text.finditer(engl):
             content = text_hit.group(2).strip()
-            if content in self.texttags:
+            # One lookup (the indices may be backed by the transmap store)
+            texttag_transl = self.texttags.get(content)
+            if texttag_transl is not None:
                 # Assemble the correct replacement string
-                translated = text_hit.group(1) + self.texttags[content] + text_hit.group(3)
+                translated = text_hit.group(1) + texttag_transl + text_hit.group(3)
                 texttag_replace[text_hit.group(0)] = translated
             else: # Untranslatable tag
                 return None # Cant fully translate this string
         # Check if it matches
-        if normalized not in self.ifpatterns:
+        transl = self.ifpatterns.get(normalized)
+        if transl is None:
             return None # Do not have pattern
-        transl = self.ifpatterns[normalized]
         # Find formulae in english text
         #
         # Replace one-by-one
@@ -204,6 +317,10 @@ class NameAutotranslator(object):
             raise "Please create name translation mapping for {}".format(lang)
         self.transmap = transmap[lang]
 
+    @property
+    def cache_key(self):
+        return "name:{}:{}".format(self.lang, config_hash(*regex_patterns(self), self.transmap))
+
     def replace_name(self, lang, name):
         """
         Get the localized replacement name
@@ -263,6 +380,9 @@ class FullAutoTranslator(object):
     """
     Google translate based full auto translator
     """
+    # Results depend on an external service and on the limit => not stored on disk
+    cache_key = None
+
     def __init__(self, lang, limit=25):
         self.lang = lang if lang != "lol" else "de" # LOL => translate to DE
         # Generate nonce to fix some bad translations
@@ -513,7 +633,10 @@ class FullAutoTranslator(object):
     
 
     def yandex_translate(self,txt):
-
+        host = "https://translate.yandex.net/api/v1.5/tr.json/translate"
+        key = 'trnsl.1.1.20171202T133038Z.284a1f7f3c4c7f0f.3bc14c3826e10105dbf20850e33e1c84136d66e7'
+        yandexResult = requests.get(host, params={'key': key,'lang':'en-sv','text':txt})
+        return yandexResult.text[yandexResult.text.index('[')+2:yandexResult.text.index(']')-1]
 
     def google_translate(self, txt):
         translator = Translator()
@@ -523,17 +646,14 @@ class FullAutoTranslator(object):
         # partition: sv-SE => sv
         googleResult = translator.translate(txt, src="en", dest=self.lang.partition("-")[0])
         
-        host = "https://translate.yandex.net/api/v1.5/tr.json/translate"
-        key = 'trnsl.1.1.20171202T133038Z.284a1f7f3c4c7f0f.3bc14c3826e10105dbf20850e33e1c84136d66e7'
-        yandexResult = requests.get(host, params={'key': key,'lang':'en-sv','text':txt})
-
-        yandexOutput = yandexResult.text[yandexResult.text.index('[')+2:yandexResult.text.index(']')-1]
+        yandexOutput = self.yandex_translate(txt)
         results = {"Google Translate":googleResult.text, "Yandex Translate":yandexOutput}
         print('\n')
         for k in results:
             print('Engine:',k)
             print('Output:',results[k])
             print('\n')
+        return googleResult.text
 
     def check_regex_equal(self, regex, s1, s2, desc):
         m1 = [m.group(0).strip() for m in regex.finditer(s1)]
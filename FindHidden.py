@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import argparse
-import polib
+from MappedInput import read_po_file
 
 
 if __name__ == "__main__":
@@ -11,7 +11,7 @@ if __name__ == "__main__":
     parser.add_argument('n', type=int, help='How many words to look for')
     args = parser.parse_args()
 
-    pot = polib.pofile(args.potfile)
+    pot = read_po_file(args.potfile)
 
     for po in pot:
         if args.tag not in po.tcomment:
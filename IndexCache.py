@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent per-file pattern index for incremental autotranslate --index runs.
+
+The cache is stored in cache/index-<lang>:
+
+- manifest.json: the mtime and size of every indexed file, a hash
+  of the text tags the pattern index was built with and the cache format
+- files/<md5 of filename>.pickle: the counters of the indexer shard of one file
+- totals.pickle: the counters of all files merged
+
+When files change, their old counters are subtracted from the totals
+and the counters of the new version are merged into them.
+"""
+import os
+import pickle
+import hashlib
+import shutil
+import simplejson as json
+
+__all__ = ["IndexCache", "texttags_hash"]
+
+# Increment when the layout of the indexer counters changes
+cache_format = 2
+
+def texttags_hash(texttags):
+    """
+    Hash of the set of translated text tags. The pattern index
+    of a file depends on it, so the cache is rebuilt when it changes.
+    """
+    return hashlib.md5("\n".join(sorted(texttags)).encode("utf-8")).hexdigest()
+
+def _file_stat(filename):
+    stat = os.stat(filename)
+    return {"mtime": stat.st_mtime_ns, "size": stat.st_size}
+
+class IndexCache(object):
+    def __init__(self, lang, texttags, directory=None):
+        self.directory = directory or os.path.join("cache", "index-{}".format(lang))
+        self.texttags_hash = texttags_hash(texttags)
+        self.manifest = {"format": cache_format, "texttags": self.texttags_hash, "files": {}}
+        self._invalidated = False
+
+    def _manifest_filename(self):
+        return os.path.join(self.directory, "manifest.json")
+
+    def _totals_filename(self):
+        return os.path.join(self.directory, "totals.pickle")
+
+    def _shard_filename(self, filename):
+        digest = hashlib.md5(filename.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, "files", "{}.pickle".format(digest))
+
+    def load(self):
+        """
+        Load the manifest and return the counters of the totals
+        or None if there is no usable cache (which is then cleared)
+        """
+        try:
+            with open(self._manifest_filename()) as infile:
+                manifest = json.load(infile)
+            if manifest.get("format") != cache_format:
+                raise ValueError()
+            if manifest["texttags"] != self.texttags_hash:
+                print("Text tags changed, rebuilding the pattern index")
+                raise ValueError()
+            with open(self._totals_filename(), "rb") as infile:
+                totals = pickle.load(infile)
+        except (FileNotFoundError, ValueError, KeyError, pickle.UnpicklingError, EOFError):
+            shutil.rmtree(self.directory, ignore_errors=True)
+            return None
+        self.manifest = manifest
+        return totals
+
+    def outdated_files(self, filenames):
+        """
+        Compare the given files with the manifest.
+        Returns (changed or new files, files which have been removed)
+        """
+        files = self.manifest["files"]
+        changed = [filename for filename in filenames
+                   if files.get(filename) != _file_stat(filename)]
+        current = set(filenames)
+        removed = [filename for filename in files if filename not in current]
+        return changed, removed
+
+    def is_cached(self, filename):
+        return filename in self.manifest["files"]
+
+    def load_shard(self, filename):
+        """The counters stored for the given file"""
+        with open(self._shard_filename(filename), "rb") as infile:
+            return pickle.load(infile)
+
+    def _invalidate(self):
+        # Once shards are modified, the old manifest and totals don't match them
+        # anymore. Remove the manifest so an interrupted run causes a rebuild.
+        if not self._invalidated:
+            try:
+                os.remove(self._manifest_filename())
+            except FileNotFoundError:
+                pass
+            self._invalidated = True
+
+    def store_shard(self, filename, counters):
+        self._invalidate()
+        shard_filename = self._shard_filename(filename)
+        os.makedirs(os.path.dirname(shard_filename), exist_ok=True)
+        with open(shard_filename, "wb") as outfile:
+            pickle.dump(counters, outfile, pickle.HIGHEST_PROTOCOL)
+        self.manifest["files"][filename] = _file_stat(filename)
+
+    def remove_shard(self, filename):
+        self._invalidate()
+        try:
+            os.remove(self._shard_filename(filename))
+        except FileNotFoundError:
+            pass
+        self.manifest["files"].pop(filename, None)
+
+    def write(self, totals):
+        """Write the counters of all files and the manifest"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._totals_filename(), "wb") as outfile:
+            pickle.dump(totals, outfile, pickle.HIGHEST_PROTOCOL)
+        # Manifest last: It is only valid together with the totals
+        with open(self._manifest_filename(), "w") as outfile:
+            json.dump(self.manifest, outfile)
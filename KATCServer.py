@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 from bottle import route, run, template, request, response
 import simplejson as json
-from AutoTranslateCommon import transmap_filename
+from TransmapStore import read_top_patterns, resolve_pattern_files
 
 @route('/apiv2/<lang>')
 def index():
@@ -9,17 +9,13 @@ def index():
 
 @route('/apiv2/patterns/<lang>')
 def patterns(lang):
-    with open(transmap_filename(lang, "ifpatterns")) as infile:
-        data = json.load(infile)
     response.content_type = 'application/json'
-    return json.dumps(data[:200])
+    return json.dumps(resolve_pattern_files(lang, read_top_patterns(lang, "ifpatterns", 200)))
 
 
 @route('/apiv2/texttags/<lang>')
 def patterns(lang):
-    with open(transmap_filename(lang, "texttags")) as infile:
-        data = json.load(infile)
     response.content_type = 'application/json'
-    return json.dumps(data[:200])
+    return json.dumps(resolve_pattern_files(lang, read_top_patterns(lang, "texttags", 200)))
 
 run(host='localhost', port=9921)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+HTTP API to lint single strings against the rules of a language.
+
+The rules of all languages are compiled once at startup, so a request only
+needs to apply the rules to the given strings. Example:
+
+    curl -d '[{"msgid": "Red", "msgstr": "Red"}]' localhost:9923/api/lint/de
+"""
+from bottle import run, request, response, Bottle
+import simplejson as json
+import os
+from ansicolor import red
+from Rules import importRulesForLanguage
+from check import XLIFFEntry
+
+app = Bottle()
+
+# lang => [(rule, rule meta dict)]
+rulesByLanguage = {}
+
+def findRuleLanguages(directory="rules"):
+    """Find all languages that have a rule module"""
+    return sorted(f[:-3] for f in os.listdir(directory)
+                  if f.endswith(".py") and f != "__init__.py")
+
+def loadRules(languages):
+    for lang in languages:
+        try:
+            rules, _ = importRulesForLanguage(lang)
+        except Exception as ex:
+            print(red("Could not load rules for {}: {}".format(lang, ex), bold=True))
+            continue
+        # Precompute meta info as computing machine names is rather slow
+        rulesByLanguage[lang] = [(rule, rule.meta_dict) for rule in sorted(rules, reverse=True)]
+
+_entryFields = ("msgid", "msgstr", "note", "filename")
+
+def parseEntry(index, obj):
+    """Validate one entry of a batch. Raises ValueError if it is malformed"""
+    if isinstance(obj, dict):
+        fields = [obj.get(field, "") for field in _entryFields]
+    elif isinstance(obj, list) and len(obj) <= len(_entryFields):
+        fields = obj + [""] * (len(_entryFields) - len(obj))
+    else:
+        raise ValueError("Entry {} must be an object or a list of at most {} strings".format(
+            index, len(_entryFields)))
+    for field, value in zip(_entryFields, fields):
+        if not isinstance(value, str):
+            raise ValueError("Entry {}: {} must be a string".format(index, field))
+    return tuple(fields)
+
+def parseEntries(data):
+    """
+    Parse a list of objects with msgid, msgstr, note & filename keys
+    or a list of [msgid, msgstr, note, filename] lists.
+    A single object is also accepted.
+    Raises ValueError if any entry is malformed
+    """
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list):
+        raise ValueError("Expected a list of entries")
+    return [parseEntry(index, obj) for index, obj in enumerate(data)]
+
+def lint(lang, msgid, msgstr, note="", filename=""):
+    """Apply all rules of the given language to one string. Returns a list of hits"""
+    entry = XLIFFEntry(None, msgid, msgstr, not msgstr, note)
+    return [{"hit": hit, "rule": meta}
+            for rule, meta in rulesByLanguage[lang]
+            for hit in rule.apply_to_xliff_entry(entry, filename or "")]
+
+@app.hook('after_request')
+def enable_cors():
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+    response.headers['Access-Control-Allow-Headers'] = 'Origin, Accept, Content-Type, X-Requested-With, X-CSRF-Token'
+
+@app.get('/api/languages')
+def languagesAPI():
+    response.content_type = 'application/json'
+    return json.dumps(sorted(rulesByLanguage.keys()))
+
+@app.get('/api/lint/<lang>')
+def lintSingleAPI(lang):
+    if lang not in rulesByLanguage:
+        response.status = 404
+        return {"error": "No rules for language {}".format(lang)}
+    q = request.query
+    return {"hits": lint(lang, q.msgid, q.msgstr, q.note, q.filename)}
+
+@app.post('/api/lint/<lang>')
+def lintBatchAPI(lang):
+    """Lint a batch of strings. Returns one hit list per string, in order"""
+    if lang not in rulesByLanguage:
+        response.status = 404
+        return {"error": "No rules for language {}".format(lang)}
+    try:
+        entries = parseEntries(json.loads(request.body.read().decode("utf-8")))
+    except ValueError as ex:
+        response.status = 400
+        return {"error": "Invalid request: {}".format(ex)}
+    return {"results": [lint(lang, *entry) for entry in entries]}
+
+def run_lint_server(args):
+    languages = args.languages.split(",") if args.languages else findRuleLanguages()
+    loadRules(languages)
+    print("Loaded rules for {}".format(", ".join(sorted(rulesByLanguage.keys()))))
+    run(app, host=args.host, port=args.port)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared input layer for the XLIFF / PO cache files.
+
+Files are memory-mapped and passed to the parsers as bytes, so they are
+neither copied into a read buffer nor decoded into one large string.
+lxml keeps the parsed text as UTF-8 and only decodes the fields
+which are actually accessed.
+"""
+import mmap
+import contextlib
+import lxml.etree
+import polib
+from bs4 import BeautifulSoup
+
+__all__ = ["map_file", "parse_xliff_tree", "find_xliff_body",
+           "element_text", "parse_xliff_soup", "read_po_file"]
+
+@contextlib.contextmanager
+def map_file(filename):
+    """
+    Context manager which maps the given file read-only.
+    Yields a bytes-like object (b"" for empty files, which can't be mapped).
+    """
+    with open(filename, "rb") as infile:
+        try:
+            mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty file
+            mapped = None
+        if mapped is None:
+            yield b""
+        else:
+            with mapped:
+                yield mapped
+
+def parse_xliff_tree(filename):
+    """
+    Parse a XLIFF file into a lxml tree. Broken XML is parsed as far as
+    possible (like BeautifulSoup does). Returns the root element or None.
+    """
+    with map_file(filename) as data:
+        if not data:
+            return None
+        # Parsers must not be shared between threads
+        parser = lxml.etree.XMLParser(recover=True, huge_tree=True, resolve_entities=False)
+        return lxml.etree.fromstring(data, parser)
+
+def find_xliff_body(root):
+    """
+    Get the <body> element of a tree from parse_xliff_tree()
+    or None if it's not a valid XLIFF tree.
+    """
+    if root is None or lxml.etree.QName(root).localname != "xliff":
+        return None
+    return root.find("{*}file/{*}body")
+
+def element_text(element):
+    """Text content of an element, like BeautifulSoup's .text"""
+    return "".join(element.itertext())
+
+def parse_xliff_soup(filename):
+    """
+    Parse a XLIFF file into a BeautifulSoup (for code that modifies and exports the XLIFF).
+    """
+    with map_file(filename) as data:
+        return BeautifulSoup(data, "lxml-xml")
+
+def read_po_file(filename):
+    """
+    Parse a PO / POT file using polib, decoding the mapped file in one step.
+    """
+    with map_file(filename) as data:
+        return polib.pofile(str(data, "utf-8"))
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 from check import *
 from ansicolor import black
-import polib
+from MappedInput import read_po_file
 from Languages import findAvailableLanguages
 
 def loadTranslations(conn, recordTable=1, indexTable=2):
@@ -30,7 +30,7 @@ def loadTranslations(conn, recordTable=1, indexTable=2):
             #  avoid tons of Python function calls.
             # The large values are be handled in C++ code efficiently.
             print("\tProcessing {}".format(filename))
-            po = polib.pofile(filename)
+            po = read_po_file(filename)
             # Write table 1
             values = {entry.msgid: lang + "\x1D" + entry.msgstr
                       for entry in po if entry.msgstr.strip()}
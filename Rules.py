@@ -5,6 +5,8 @@ import cffi_re2
 import os
 import sys
 import fnmatch
+import copy
+import hashlib
 from collections import defaultdict
 from enum import IntEnum
 import importlib
@@ -14,6 +16,7 @@ from io import StringIO
 import sre_constants
 import csv
 from Perseus import *
+from AutoTranslateCommon import normalize_ifpattern
 
 class Severity(IntEnum):
     # Notice should be used for rules where a significant number of unfixable false-positives are expected
@@ -82,6 +85,10 @@ def importRulesForLanguage(lang, basedir="."):
 
 _extractImgRegex = reCompiler.compile(r"(https?://ka-perseus-graphie\.s3\.amazonaws\.com/[0-9a-f]{40,40}\.(png|svg))")
 
+def extractImages(s):
+    """Find all Perseus image URLs in the given string"""
+    return [h[0] for h in _extractImgRegex.findall(s)]
+
 class Rule(object):
     """
     A baseclass for rules.
@@ -127,6 +134,35 @@ class Rule(object):
             "color": self.getBootstrapColor(),
         }
 
+    @property
+    def needs_tcomment(self):
+        """
+        Whether this rule reads the tcomment (i.e. the XLIFF note).
+        Notes are only loaded for files where a rule needs them.
+        Wrappers depend on their child.
+        """
+        child = getattr(self, "child", None)
+        return child is not None and child.needs_tcomment
+
+    def for_file(self, filename):
+        """
+        Get the rule to apply to all entries of the given file,
+        or None if the rule can't produce hits in that file.
+        Wrappers resolve their filename-dependent checks here once per file.
+        """
+        return self
+
+    def _child_for_file(self, filename):
+        """for_file() for wrappers which don't depend on the filename themselves"""
+        child = self.child.for_file(filename)
+        if child is None:
+            return None
+        if child is self.child:
+            return self
+        wrapper = copy.copy(self)
+        wrapper.child = child
+        return wrapper
+
     def __lt__(self, other):
         if self.severity != other.severity:
             return self.severity < other.severity
@@ -134,19 +170,16 @@ class Rule(object):
 
     def apply_to_xliff_entry(self, entry, filename, ignore_untranslated=True):
         """
-        Apply to a dictionary of parsed PO files.
-        Yields tuples entry, hit, filename
+        Apply to a single XLIFF entry.
+        Yields only the hits. Images are not extracted here
+        as they are only required when writing the output.
         """
         if ignore_untranslated and entry.is_untranslated:
             return
         # Translated string cleanup
         translated = cleanupTranslatedString(entry.translated)
         # Apply the rule
-        for hit in self(translated, entry.english, entry.note or "", filename=filename):
-            #Find images in both original and new string
-            origImages = [h[0] for h in _extractImgRegex.findall(entry.english)]
-            translatedImages = [h[0] for h in _extractImgRegex.findall(translated)]
-            yield (entry, hit, filename, origImages, translatedImages)
+        yield from self(translated, entry.english, entry.note or "", filename=filename)
 
     def apply_to_po(self, po, filename="[unknown file]", ignore_untranslated=True):
         """
@@ -364,6 +397,10 @@ class IgnoreByFilenameRegexWrapper(Rule):
             return "%s (only applied to filenames matching '%s')" % (self.child.description, self.filename_regex_str)
         else:
             return "%s (ignored for filenames matching '%s')" % (self.child.description, self.filename_regex_str)
+    def for_file(self, filename):
+        if bool(self.filename_regex.match(filename)) != self.invert:
+            return None
+        return self.child.for_file(filename)
     def __call__(self, msgstr, msgid, tcomment="", filename=None):
         if bool(self.filename_regex.match(filename)) != self.invert:
             return None
@@ -381,6 +418,10 @@ class IgnoreByFilenameListWrapper(Rule):
     @property
     def description(self):
         return "%s (ignored for files %s)" % (self.child.description, str(list(self.filenames)))
+    def for_file(self, filename):
+        if filename in self.filenames:
+            return None
+        return self.child.for_file(filename)
     def __call__(self, msgstr, msgid, tcomment="", filename=None):
         if filename in self.filenames:
             return None
@@ -405,6 +446,8 @@ class IgnoreByMsgidRegexWrapper(Rule):
     @property
     def description(self):
         return "%s (ignored for msgids matching '%s')" % (self.child.description, self.msgid_regex_str)
+    def for_file(self, filename):
+        return self._child_for_file(filename)
     def __call__(self, msgstr, msgid, tcomment="", filename=None):
         if self.msgid_regex.search(msgid):
             return None
@@ -430,6 +473,8 @@ class IgnoreByMsgstrRegexWrapper(Rule):
     @property
     def description(self):
         return "%s (ignored for msgids matching '%s')" % (self.child.description, self.msgid_regex_str)
+    def for_file(self, filename):
+        return self._child_for_file(filename)
     def __call__(self, msgstr, msgid, tcomment="", filename=None):
         if self.msgstr_regex.search(msgstr):
             return None
@@ -454,6 +499,11 @@ class IgnoreByTcommentRegexWrapper(Rule):
     @property
     def description(self):
         return "%s (ignored for tcomments matching '%s')" % (self.child.description, self.tcomment_regex_str)
+    @property
+    def needs_tcomment(self):
+        return True
+    def for_file(self, filename):
+        return self._child_for_file(filename)
     def __call__(self, msgstr, msgid, tcomment="", filename=None):
         if self.tcommentRegex.search(tcomment):
             return None
@@ -497,6 +547,107 @@ class TextListRule(Rule):
             else:
                 yield hit
 
+class CorpusRule(Rule):
+    """
+    A baseclass for rules which can only decide after having seen all entries.
+
+    The rule itself has no state: The entries of a file (or of a part of it)
+    are summarized in a compact, JSON-serializable record (new_record(),
+    observe()) and the records of the parts of a file are combined with
+    merge_records(). Once the records of all files are known, corpus_hits()
+    yields (filename, id, hit) tuples. apply_to_xliff_entry() never yields hits.
+    """
+    def __call__(self, msgstr, msgid, tcomment="", filename=None):
+        return iter(())
+    def apply_to_xliff_entry(self, entry, filename, ignore_untranslated=True):
+        return iter(())
+    def new_record(self):
+        return {}
+    def observe(self, record, entry):
+        raise NotImplementedError()
+    def merge_records(self, record, other):
+        """Add the record of the next part of a file to record"""
+        raise NotImplementedError()
+    def record_to_json(self, record):
+        return record
+    def record_from_json(self, obj):
+        return obj
+    def corpus_hits(self, records):
+        """Compare the records of all files, given as a filename => record dict"""
+        raise NotImplementedError()
+
+def _stable_hash(s):
+    """64 bit hash which, unlike hash(), is the same in every process"""
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+
+class TranslationConsistencyRule(CorpusRule):
+    """
+    Finds english strings which are translated differently in different places.
+    Strings are grouped by their source with formulas and images replaced
+    (like IgnoreFormulaPatternIndexer).
+
+    Records only contain hashes, counts and trans-unit IDs: One entry per
+    distinct source with at most max_variants translations, each with the
+    number of units and the first unit ID. The texts of the hits are read
+    from the files when rendering. Occurrences of a translation which is
+    not among the first max_variants translations of its file are only
+    counted in the total.
+    """
+    def __init__(self, name="Inconsistent translation", severity=Severity.info, max_variants=5):
+        super().__init__(name, severity)
+        self.max_variants = max_variants
+    @property
+    def description(self):
+        return "Same english string (ignoring formulas and images) translated in different ways"
+    def _normalize(self, s):
+        return normalize_ifpattern(s).strip()
+    def observe(self, record, entry):
+        # record: hash(normalized source) => [total count, [transl hash, count, first id]...]
+        if entry.is_untranslated:
+            return
+        source_key = _stable_hash(self._normalize(entry.english))
+        self._add_variant(record, source_key, 1, [_stable_hash(self._normalize(entry.translated)), 1, entry.id])
+    def _add_variant(self, record, source_key, total, new_variant):
+        variants = record.get(source_key)
+        if variants is None:
+            record[source_key] = [total, list(new_variant)]
+            return
+        variants[0] += total
+        for variant in variants[1:]:
+            if variant[0] == new_variant[0]:
+                variant[1] += new_variant[1]
+                # Keep the first example by location so the output is reproducible
+                variant[2:] = min(variant[2:], new_variant[2:])
+                return
+        if len(variants) <= self.max_variants:
+            variants.append(list(new_variant))
+    def merge_records(self, record, other):
+        for source_key, (total, *variants) in other.items():
+            for idx, variant in enumerate(variants):
+                self._add_variant(record, source_key, total if idx == 0 else 0, variant)
+    def record_to_json(self, record):
+        return [[source_key] + variants for source_key, variants in record.items()]
+    def record_from_json(self, obj):
+        return {item[0]: item[1:] for item in obj}
+    def corpus_hits(self, records):
+        # Same record layout, but the variants store [transl hash, count, filename, first id]
+        sources = {}
+        for filename in sorted(records):
+            for source_key, (total, *variants) in records[filename].items():
+                for idx, (translation_key, count, id) in enumerate(variants):
+                    self._add_variant(sources, source_key, total if idx == 0 else 0,
+                                      [translation_key, count, filename, id])
+        for record in sources.values():
+            if len(record) < 3:  # Only one variant
+                continue
+            total, variants = record[0], record[1:]
+            num_variants = "{}{}".format(len(variants),
+                "+" if total > sum(variant[1] for variant in variants) else "")
+            for _, count, filename, id in variants:
+                yield (filename, id,
+                       "Translated in {} different ways ({} of {} units like this)".format(
+                           num_variants, count, total))
+
 
 def findRule(rules, name):
     "Find a rule by name"
@@ -552,6 +703,8 @@ class IgnorePerseusCommandsRuleWrapper(Rule):
     @property
     def description(self):
         return "%s (ignored for Perseus commands)" % (self.child.description)
+    def for_file(self, filename):
+        return self._child_for_file(filename)
     def __call__(self, msgstr, msgid, tcomment="", filename=None):
         for cmd in self.perseusList:
             msgstr = msgstr.replace("\\{0}".format(cmd), "")
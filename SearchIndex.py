@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Inverted word index over the rendered rule hits.
+
+The index is written as static files to <outdir>/<lang>/search:
+
+- meta.json: number of shards plus, for every rule, the ID of its first
+  hit and its number of hits. Hit IDs are assigned consecutively in the
+  order in which the overview <rule>.json files list the hits, so
+  hit ID - first_id is the position of the hit in the rule hit list.
+- <shard>.json: token => sorted list of hit IDs, for all tokens
+  with zlib.crc32(token as UTF-8) % num_shards == shard
+
+A query only needs to load meta.json and one shard file per query word.
+"""
+import array
+import re
+import os
+import zlib
+import shutil
+import bisect
+import simplejson as json
+
+__all__ = ["SearchIndex", "tokenize", "search_hits"]
+
+_token_regex = re.compile(r"\w{2,}")
+
+def tokenize(s):
+    """Split a string into the set of lowercase words it contains"""
+    return set(_token_regex.findall(s.casefold()))
+
+def token_shard(token, num_shards):
+    return zlib.crc32(token.encode("utf-8")) % num_shards
+
+class SearchIndex(object):
+    """
+    Builds the inverted index incrementally while the hits are written.
+
+    The hits of a rule are kept in segments (e.g. one per file), so the
+    segments of changed files can be replaced without indexing all hits
+    again. Hit IDs are assigned when the index is written.
+    """
+    def __init__(self, tokens_per_shard=5000):
+        self.tokens_per_shard = tokens_per_shard
+        self.token_ids = {}  # token => token ID
+        self.tokens = []  # token ID => token
+        # rule machine name => [[key, number of hits, token IDs, hit positions]]
+        # (one entry in the arrays per token of every hit)
+        self.rules = {}
+
+    def segments(self, rule_name):
+        """List of (key, number of hits) of the segments of a rule, in order"""
+        return [(segment[0], segment[1]) for segment in self.rules.get(rule_name, [])]
+
+    def index_hits(self, rule_name, hits, key=None):
+        """
+        Add the JSON hits of a rule to the index while passing them through.
+        Wrap the hit iterable given to the writer with this generator.
+        The hits are appended to the rule as a new segment with the given key.
+        """
+        return self._index_segment(self.rules.setdefault(rule_name, []), key, hits)
+
+    def replace_hits(self, rule_name, key, hits):
+        """
+        Like index_hits(), but replace the segment of the rule with the given key
+        (or append a new segment if there is none).
+        """
+        segments = self.rules.setdefault(rule_name, [])
+        for idx, segment in enumerate(segments):
+            if segment[0] == key:
+                del segments[idx]
+                return self._index_segment(segments, key, hits, idx)
+        return self._index_segment(segments, key, hits)
+
+    def _index_segment(self, segments, key, hits, idx=None):
+        # Segments without hits are not stored
+        segment = None
+        for hit in hits:
+            if segment is None:
+                segment = [key, 0, array.array("I"), array.array("I")]
+                segments.insert(len(segments) if idx is None else idx, segment)
+            _, position, token_ids, positions = segment
+            text = "{} {}".format(hit.get("msgid", ""), hit.get("msgstr", ""))
+            for token in tokenize(text):
+                token_id = self.token_ids.get(token)
+                if token_id is None:
+                    token_id = self.token_ids[token] = len(self.tokens)
+                    self.tokens.append(token)
+                token_ids.append(token_id)
+                positions.append(position)
+            segment[1] += 1
+            yield hit
+
+    def write(self, directory, page_size=None):
+        """
+        Write the index to the given directory, replacing any previous index.
+        """
+        postings = {}  # token ID => array of hit IDs
+        rules = []  # [machine name, first hit ID, number of hits]
+        num_hits = 0
+        for rule_name, segments in self.rules.items():
+            first_id = num_hits
+            for _, segment_hits, token_ids, positions in segments:
+                for token_id, position in zip(token_ids, positions):
+                    token_postings = postings.get(token_id)
+                    if token_postings is None:
+                        token_postings = postings[token_id] = array.array("I")
+                    token_postings.append(num_hits + position)
+                num_hits += segment_hits
+            if num_hits > first_id:
+                rules.append([rule_name, first_id, num_hits - first_id])
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        num_shards = max(1, -(-len(postings) // self.tokens_per_shard))
+        shards = [{} for _ in range(num_shards)]
+        for token_id, token_postings in postings.items():
+            token = self.tokens[token_id]
+            shards[token_shard(token, num_shards)][token] = token_postings.tolist()
+        for shard, tokens in enumerate(shards):
+            with open(os.path.join(directory, "{}.json".format(shard)), "w") as outfile:
+                json.dump(tokens, outfile)
+        with open(os.path.join(directory, "meta.json"), "w") as outfile:
+            json.dump({
+                "num_shards": num_shards,
+                "num_hits": num_hits,
+                "num_tokens": len(postings),
+                "page_size": page_size,
+                "rules": [{"rule": name, "first_id": first_id, "num_hits": count}
+                          for name, first_id, count in rules]
+            }, outfile)
+
+def search_hits(directory, query):
+    """
+    Find the hits containing all words of the query using the index in
+    the given directory. Returns a list of (rule machine name, hit position) tuples.
+    Reference implementation for clients of the static index.
+    """
+    with open(os.path.join(directory, "meta.json")) as infile:
+        meta = json.load(infile)
+    result = None
+    for token in tokenize(query):
+        shard_file = os.path.join(directory, "{}.json".format(
+            token_shard(token, meta["num_shards"])))
+        with open(shard_file) as infile:
+            ids = set(json.load(infile).get(token, []))
+        result = ids if result is None else result & ids
+    first_ids = [info["first_id"] for info in meta["rules"]]
+    hits = []
+    for hit_id in sorted(result or []):
+        info = meta["rules"][bisect.bisect_right(first_ids, hit_id) - 1]
+        hits.append((info["rule"], hit_id - info["first_id"]))
+    return hits
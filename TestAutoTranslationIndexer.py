@@ -1,19 +1,137 @@
 #!/usr/bin/env python3
+import os
+import math
+import random
+import shutil
+import argparse
+import tempfile
+from collections import Counter
 from AutoTranslationTranslator import *
+from AutoTranslationIndexer import HashCounter, CountMinSketch
 from ansicolor import red
 
+def assertClassifierEquivalent(engl):
+    trans = RuleAutotranslator()
+    result = trans.translate(engl)
+    expected = trans.reference_translate(engl)
+    if result != expected:
+        print(red("Classifier result '{}' differs from '{}' for '{}'".format(
+            result, expected, engl), bold=True))
+
 def assertSame(engl):
+    assertClassifierEquivalent(engl)
     trans = RuleAutotranslator()
     result = trans.translate(engl)
     if result != engl:
         print(red("Failed to autotranslate '{}'".format(engl), bold=True))
 
 def assertNotTranslated(engl):
+    assertClassifierEquivalent(engl)
     trans = RuleAutotranslator()
     result = trans.translate(engl)
     if result is not None:
         print(red("String should not be translated:'{}'".format(engl), bold=True))
 
+def assertCounts(counter, expected, what):
+    """Compare a HashCounter with a Counter of the same hashes"""
+    keys, counts = counter.items()
+    result = {int(key).to_bytes(4, "little"): int(count) for key, count in zip(keys, counts)}
+    if result != expected or len(counter) != len(expected):
+        print(red("{}: {} keys differ from Counter".format(
+            what, len(set(result.items()) ^ set(expected.items()))), bold=True))
+    for h, count in expected.items():
+        if counter[h] != count or h not in counter:
+            print(red("{}: Lookup of {} returned {} instead of {}".format(
+                what, h.hex(), counter[h], count), bold=True))
+            break
+    missing = hash_string("not counted")
+    if missing not in expected and (counter[missing] != 0 or missing in counter):
+        print(red("{}: Found a key which was never added".format(what), bold=True))
+
+def assertHashCounterExact():
+    """HashCounter must count like Counter, across resizes and merges"""
+    rng = random.Random(0)
+    hashes = [hash_string(str(int(rng.paretovariate(0.8)))) for _ in range(50000)]
+    expected = Counter(hashes)
+    # Small capacity and buffer => many flushes and resizes past the load factor
+    counter = HashCounter(capacity=16, buffer_size=1000)
+    for h in hashes:
+        counter.add(h)
+    assertCounts(counter, expected, "HashCounter")
+    # Shards merged in order, like run_index()
+    merged = HashCounter(capacity=16)
+    for start in range(0, len(hashes), 17000):
+        shard = HashCounter(capacity=16, buffer_size=1000)
+        for h in hashes[start:start + 17000]:
+            shard.add(h)
+        merged.merge(shard)
+    assertCounts(merged, expected, "Merged HashCounter")
+    assertCounts(counter.filter(5), Counter({h: count for h, count in expected.items() if count >= 5}),
+                 "Filtered HashCounter")
+
+def assertCountMinSketchBounds(width=1024, depth=4):
+    """Estimates are never too low (below max_count) and rarely more than e/width * N too high"""
+    rng = random.Random(0)
+    keys = ["pattern {}".format(int(rng.paretovariate(0.5))).encode("utf-8") for _ in range(20000)]
+    sketch = CountMinSketch(width, depth)
+    counts = Counter()
+    errors = {}  # key => estimate - count after its last instance
+    for key in keys:
+        counts[key] += 1
+        estimate = sketch.add(key)
+        if estimate < min(counts[key], CountMinSketch.max_count):
+            print(red("Count-min sketch undercounts {}: {} < {}".format(
+                key, estimate, counts[key]), bold=True))
+            return
+        errors[key] = estimate - counts[key]
+    bound = math.e / width * len(keys)
+    too_high = [key for key, error in errors.items()
+                if counts[key] < CountMinSketch.max_count and error > bound]
+    if len(too_high) > math.exp(-depth) * len(counts):
+        print(red("Count-min sketch error above {:.1f} for {} of {} keys".format(
+            bound, len(too_high), len(counts)), bold=True))
+
+def indexCorpus(workdir, num_processes):
+    """Run autotranslate --index in workdir and return the exported transmap files"""
+    from XLIFFReader import autotranslate_xliffs
+    args = argparse.Namespace(language="de", filter=None, index=True, num_processes=num_processes,
+        single_pass=False, incremental=False, sketch_width=2**22, max_pending=1000000,
+        index_ignore_translated=False, result_cache=None, full_auto=False, limit=1000000000,
+        upload=False, approve=False, overwrite=False, patterns=False, name_autotranslate=False,
+        update_index_source=False, update_index=False)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        autotranslate_xliffs(args)
+    finally:
+        os.chdir(cwd)
+    exports = {}
+    transmap = os.path.join(workdir, "transmap")
+    for filename in sorted(os.listdir(transmap)):
+        if filename.endswith(".json"):
+            with open(os.path.join(transmap, filename), "rb") as infile:
+                exports[filename] = infile.read()
+    return exports
+
+def assertIndexReproducible(num_processes=3):
+    """The exported indices must not depend on how the files are split into batches"""
+    from benchmark.corpus import generateCorpus
+    workdir = tempfile.mkdtemp(prefix="katc-test-")
+    try:
+        generateCorpus(workdir, ["de"], num_files=30, units_per_file=100, seed=1)
+        os.makedirs(os.path.join(workdir, "transmap"))
+        # The XLIFF exports are written from the template in the working directory
+        shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), "template.xliff"), workdir)
+        # The pattern index depends on the text tags exported by the previous run
+        indexCorpus(workdir, 1)
+        single = indexCorpus(workdir, 1)
+        parallel = indexCorpus(workdir, num_processes)
+        for filename, content in single.items():
+            if parallel.get(filename) != content:
+                print(red("{} differs between -j1 and -j{}".format(filename, num_processes), bold=True))
+    finally:
+        shutil.rmtree(workdir)
+
 def assertNameTrans(engl, exp):
     trans = NameAutotranslator("sv-SE")
     result = trans.translate(engl)
@@ -72,7 +190,22 @@ if __name__ == "__main__":
     assertNotTranslated("$3\\text { fives}$")
     assertNotTranslated("$3\\text { fives}$")
     assertNotTranslated("$3\\text { baabaz}$")
-    
+
+    # Rules which apply regardless of \text clauses
+    assertSame("$\\text{foo}$ [[☃ expression 1]]")
+    assertSame("$\\text{foo}$ ![](https://ka-perseus-images.s3.amazonaws.com/b8ca00d508c9e7b593c669977fdde31570195273.png)")
+    # Combinations which match none of the rules
+    assertNotTranslated("")
+    assertNotTranslated("Text [[☃ radio 1]]")
+    assertNotTranslated("[[☃ radio 1]] and [[☃ radio 2]]")
+    assertNotTranslated("(-2,4")
+    assertNotTranslated("(2, 4)")
+    assertNotTranslated("https://ka-perseus-images.s3.amazonaws.com/b8ca00d508c9e7b593c669977fdde31570195273.gif")
+    assertNotTranslated("$a$ $b")
+    for engl in ["$a$\n", "(1,2)\n", "[[☃ radio 1]]\n", "$\\text{x}$\n", ">#$a$", "**$a$**",
+                 "> $a$ = [[☃ numeric-input 1]]", "$a$ text $b$", "\\text{a}", "$$"]:
+        assertClassifierEquivalent(engl)
+
 
     # Name translation
     assertNameTrans("Only John", "Endast John")
@@ -93,3 +226,10 @@ if __name__ == "__main__":
 
     assertNameTrans("Both John and Jack are correct", "Både John och Jack har rätt")
     assertNameTrans("Both Jack and John are correct.", "Både Jack och John har rätt.")
+
+    # Pattern counters
+    assertHashCounterExact()
+    assertCountMinSketchBounds()
+
+    # Parallel indexing
+    assertIndexReproducible()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQLite store for the transmap pattern indices: transmap/<lang>.transmap.sqlite
+
+Written by the indexers together with the JSON exports (see export_patterns()).
+Consumers open it read-only instead of loading and filtering the whole
+JSON file: Servers look up single patterns (TransmapLookup), batch jobs
+read all patterns they need in one query (read_transmap()).
+"""
+import os
+import contextlib
+import sqlite3
+import threading
+import urllib.request
+from collections.abc import Mapping
+import simplejson as json
+
+__all__ = ["transmap_store_filename", "TransmapStoreWriter", "TransmapLookup",
+           "store_is_current", "open_transmap_lookup", "read_transmap", "read_top_patterns",
+           "read_file_table", "resolve_pattern_files"]
+
+_schema = """
+CREATE TABLE IF NOT EXISTS patterns (
+    kind TEXT NOT NULL,
+    english TEXT NOT NULL,
+    translated TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    untranslated_count INTEGER NOT NULL,
+    files TEXT NOT NULL,
+    type TEXT NOT NULL,
+    rank INTEGER NOT NULL,
+    PRIMARY KEY (kind, english)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS patterns_rank ON patterns (kind, rank);
+"""
+
+def transmap_store_filename(lang):
+    return os.path.join("transmap", "{}.transmap.sqlite".format(lang))
+
+def _connect_readonly(filename):
+    uri = "file:{}?mode=ro".format(urllib.request.pathname2url(os.path.abspath(filename)))
+    return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+class TransmapStoreWriter(object):
+    """
+    Replaces the patterns of one kind (e.g. "ifpatterns") in the store.
+    The new patterns become visible to readers atomically on close().
+    """
+    def __init__(self, lang, kind):
+        self.kind = kind
+        self._connection = sqlite3.connect(transmap_store_filename(lang))
+        self._connection.executescript(_schema)
+        self._connection.execute("DELETE FROM patterns WHERE kind = ?", (kind,))
+        self._rank = 0
+
+    def write(self, pattern):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO patterns VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (self.kind, pattern["english"], pattern["translated"], pattern["count"],
+             pattern["untranslated_count"], json.dumps(pattern["files"]),
+             pattern["type"], self._rank))
+        self._rank += 1
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
+
+class TransmapLookup(Mapping):
+    """
+    Read-only english => translation mapping of one kind of patterns in the store.
+    Only the patterns matching condition (a SQL expression) are visible.
+    Every thread uses its own connection. Pickles as a reference to the store.
+    """
+    def __init__(self, filename, kind, condition="1"):
+        self.filename = filename
+        self.kind = kind
+        self.condition = condition
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = _connect_readonly(self.filename)
+        return connection
+
+    def __getitem__(self, english):
+        row = self._connection().execute(
+            "SELECT translated FROM patterns WHERE kind = ? AND english = ? AND ({})".format(
+                self.condition), (self.kind, english)).fetchone()
+        if row is None:
+            raise KeyError(english)
+        return row[0]
+
+    def __iter__(self):
+        for (english,) in self._connection().execute(
+                "SELECT english FROM patterns WHERE kind = ? AND ({}) ORDER BY rank".format(
+                    self.condition), (self.kind,)):
+            yield english
+
+    def __len__(self):
+        return self._connection().execute(
+            "SELECT count(*) FROM patterns WHERE kind = ? AND ({})".format(
+                self.condition), (self.kind,)).fetchone()[0]
+
+    def __getstate__(self):
+        return (self.filename, self.kind, self.condition)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+def _json_filename(lang, kind):
+    return os.path.join("transmap", "{}.{}.json".format(lang, kind))
+
+def store_is_current(lang, kind):
+    """
+    False if there is no store or if it is older than the JSON export
+    of the given kind (e.g. after ImportXLSXTransmap.py)
+    """
+    try:
+        return os.path.getmtime(transmap_store_filename(lang)) >= \
+            os.path.getmtime(_json_filename(lang, kind))
+    except FileNotFoundError:
+        return False
+
+def open_transmap_lookup(lang, kind, condition="1"):
+    """TransmapLookup for the given language or None if the store is not current"""
+    if not store_is_current(lang, kind):
+        return None
+    return TransmapLookup(transmap_store_filename(lang), kind, condition)
+
+def read_transmap(lang, kind, condition="1"):
+    """
+    english => translation dict of the patterns matching condition, read in one
+    query (a TransmapLookup query per pattern is too slow for batch jobs).
+    None if the store is not current.
+    """
+    if not store_is_current(lang, kind):
+        return None
+    with contextlib.closing(_connect_readonly(transmap_store_filename(lang))) as connection:
+        return dict(connection.execute(
+            "SELECT english, translated FROM patterns WHERE kind = ? AND ({})".format(
+                condition), (kind,)))
+
+def read_top_patterns(lang, kind, limit):
+    """
+    The first limit patterns of the export (most untranslated first) as JSON dicts.
+    Read from the JSON export if the store is not current.
+    """
+    if not store_is_current(lang, kind):
+        with open(_json_filename(lang, kind)) as infile:
+            return json.load(infile)[:limit]
+    with contextlib.closing(_connect_readonly(transmap_store_filename(lang))) as connection:
+        rows = connection.execute(
+            "SELECT english, translated, count, untranslated_count, files, type FROM patterns "
+            "WHERE kind = ? ORDER BY rank LIMIT ?", (kind, limit)).fetchall()
+    return [{"english": english, "translated": translated, "count": count,
+             "untranslated_count": untranslated_count, "files": json.loads(files),
+             "type": pattern_type}
+            for english, translated, count, untranslated_count, files, pattern_type in rows]
+
+def read_file_table(lang):
+    """The filenames of the file table export (index = file ID) or None if there is none"""
+    try:
+        with open(_json_filename(lang, "files")) as infile:
+            return json.load(infile)
+    except FileNotFoundError:
+        return None
+
+def resolve_pattern_files(lang, patterns):
+    """
+    Replace the [[file ID, count], ...] lists of the given patterns
+    by {filename: count} dicts (in place). Returns patterns.
+    """
+    filenames = read_file_table(lang) or []
+    for pattern in patterns:
+        files = pattern["files"]
+        if isinstance(files, list):  # Not yet resolved
+            pattern["files"] = {
+                filenames[file_id] if file_id < len(filenames) else str(file_id): count
+                for file_id, count in files}
+    return patterns
@@ -11,15 +11,20 @@ from UpdateAllFiles import *
 from XLIFFUpload import *
 import concurrent.futures
 import gc
+import heapq
+import html
+import re
 import bs4
+from MappedInput import *
+from IndexCache import IndexCache
 
-def findXLIFFFiles(directory, filt=[]):
+def findXLIFFFiles(directory, filt=[], lang="de"):
     """
     Get a list of PO files (.po / .pot) which are present in the directory.
 
     filter is a nested list from argparse which defined
     """
-    transFilemap = getTranslationFilemapCache()
+    transFilemap = getTranslationFilemapCache(lang)
     if os.path.isfile(directory): #Single file>=
         poFilenames = [directory]
     else:
@@ -47,9 +52,89 @@ def findXLIFFFiles(directory, filt=[]):
                         print(red("Can't find {} in filemap - ignoring file".format(key), bold=True))
     return xliffFiles
 
+def sortBySizeDescending(filenames):
+    """
+    Sort filenames by file size (i.e. estimated processing cost), largest first
+    """
+    return sorted(filenames, key=lambda f: (-os.path.getsize(f), f))
+
+def shardXLIFFFiles(xliffs, shard, num_shards):
+    """
+    Deterministically partition a filename => file ID dict (see findXLIFFFiles)
+    into num_shards parts of roughly equal total file size.
+
+    Returns the part for the given shard (1-based)
+    """
+    sizes = {filename: os.path.getsize(filename) for filename in xliffs}
+    # Heap of (total size, shard index)
+    shardSizes = [(0, i) for i in range(num_shards)]
+    result = {}
+    # Largest first, ties broken by name so every machine computes the same partition
+    for filename in sorted(xliffs, key=lambda f: (-sizes[f], f)):
+        total, i = heapq.heappop(shardSizes)
+        heapq.heappush(shardSizes, (total + sizes[filename], i))
+        if i == shard - 1:
+            result[filename] = xliffs[filename]
+    return result
+
 def parse_xliff_file(filename):
-    with open(filename) as infile:
-        return BeautifulSoup(infile, "lxml-xml")
+    return parse_xliff_soup(filename)
+
+# The id attribute may be quoted with either " or '
+_transUnitRegex = re.compile(rb'<trans-unit\s[^>]*?\bid=(["\'])(.*?)\1[^>]*>(.*?)</trans-unit>', re.DOTALL)
+_noteRegex = re.compile(rb'<note(?:\s[^>]*)?>(.*?)</note>', re.DOTALL)
+_sourceRegex = re.compile(rb'<source(?:\s[^>]*)?>(.*?)</source>', re.DOTALL)
+_targetRegex = re.compile(rb'<target(?:\s[^>]*)?>(.*?)</target>', re.DOTALL)
+_cdataRegex = re.compile(r'<!\[CDATA\[(.*?)\]\]>', re.DOTALL)
+_tagRegex = re.compile(r'<[^>]+>')
+
+def _find_unit_elements(data, ids, regexes):
+    """
+    Yield (trans-unit id, [match of every regex or None]) for the trans-units
+    with the given IDs. The regexes are searched within the trans-unit only.
+    """
+    for unit in _transUnitRegex.finditer(data):
+        unit_id = html.unescape(unit.group(2).decode("utf-8"))
+        if unit_id in ids:
+            yield unit_id, [regex.search(data, unit.start(3), unit.end(3)) for regex in regexes]
+
+def _element_text(raw):
+    """Text content of the raw content of an element, like BeautifulSoup's .text"""
+    # Keep CDATA content verbatim, unescape everything else
+    parts = _cdataRegex.split(str(raw, "utf-8"))
+    return "".join(part if i % 2 else html.unescape(_tagRegex.sub("", part))
+                   for i, part in enumerate(parts))
+
+def find_note_offsets(filename, ids):
+    """
+    Find the byte offsets of the <note> contents for the trans-units
+    with the given IDs, without parsing the XML.
+    Returns a trans-unit id => (start, end) dict (only for units with a note).
+    """
+    with map_file(filename) as data:
+        return {unit_id: (note.start(1), note.end(1))
+                for unit_id, (note,) in _find_unit_elements(data, ids, [_noteRegex])
+                if note is not None}
+
+def read_note(filename, start, end):
+    """
+    Read a note from the byte offsets given by find_note_offsets().
+    Returns the text content like trans_unit.note.text
+    """
+    with map_file(filename) as data:
+        return _element_text(data[start:end])
+
+def read_unit_texts(filename, ids):
+    """
+    Read the source and target texts of the trans-units with the given IDs,
+    without parsing the XML. Returns a trans-unit id => (source, target) dict
+    (only for units with both).
+    """
+    with map_file(filename) as data:
+        return {unit_id: (_element_text(source.group(1)), _element_text(target.group(1)))
+                for unit_id, (source, target) in _find_unit_elements(
+                    data, ids, [_sourceRegex, _targetRegex])
+                if source is not None and target is not None}
 
 def export_xliff_file(soup, filename):
     with open(filename, "w") as outfile:
@@ -191,10 +276,11 @@ def readAndProcessXLIFFRunner(*args, **kwargs):
 
 def run(executor, xliffs, *args, **kwargs):
 
-    # Run XLIFF parser in parallel
+    # Run XLIFF parser in parallel. Submit the largest files first
+    # so they don't end up as stragglers at the end of the run
     futures = [
-        executor.submit(readAndProcessXLIFFRunner, *args, filename=filepath, fileid=fileid, **kwargs)
-        for filepath, fileid in xliffs.items()
+        executor.submit(readAndProcessXLIFFRunner, *args, filename=filepath, fileid=xliffs[filepath], **kwargs)
+        for filepath in sortBySizeDescending(xliffs.keys())
     ]
     # stats
     kwargs = {
@@ -209,6 +295,86 @@ def run(executor, xliffs, *args, **kwargs):
 
     return autotranslated_count
 
+def index_xliff_batch(lang, indexer, filenames, preindex=False):
+    """
+    Index (or preindex) a batch of files into the given (empty) indexer shard
+    and return it. Runs in a worker process.
+    """
+    autotranslator = CompositeAutoTranslator()
+    for filename in filenames:
+        readAndProcessXLIFFRunner(lang=lang, filename=filename, fileid=None,
+            indexer=indexer, autotranslator=autotranslator,
+            autotranslate=False, preindex=preindex)
+    return indexer
+
+def split_by_size(filenames, num_batches):
+    """
+    Split a list of filenames into at most num_batches
+    contiguous batches of roughly equal total file size.
+    """
+    sizes = [os.path.getsize(filename) for filename in filenames]
+    batch_size = sum(sizes) / num_batches
+    batches = []
+    total = 0
+    for filename, size in zip(filenames, sizes):
+        if not batches or (total >= batch_size * len(batches) and len(batches) < num_batches):
+            batches.append([])
+        batches[-1].append(filename)
+        total += size
+    return batches
+
+def run_index(executor, xliffs, lang, indexer, num_batches, preindex=False):
+    """
+    Index all files on a process pool. Every batch of files is indexed into
+    its own shard. The shards are merged into the given indexer in file order,
+    so the result is the same as when indexing the files one by one.
+    """
+    batches = split_by_size(sortBySizeDescending(xliffs.keys()), num_batches)
+    futures = [
+        executor.submit(index_xliff_batch, lang, indexer.new_shard(), batch, preindex)
+        for batch in batches
+    ]
+    for future in tqdm(futures, unit="batch"):
+        indexer.merge(future.result())
+
+def index_xliff_files(lang, indexer, filenames):
+    """
+    Index every file of a batch into its own (empty) shard.
+    Returns a list of (filename, shard counters). Runs in a worker process.
+    """
+    return [(filename, index_xliff_batch(lang, indexer.new_shard(), [filename]).counters())
+            for filename in filenames]
+
+def run_incremental_index(executor, xliffs, lang, indexer, num_batches, index_cache):
+    """
+    Fill the given (empty) indexer from the index cache, only indexing
+    the files which have been changed, added or removed since the last run.
+    """
+    totals = index_cache.load()
+    if totals is not None:
+        indexer.merge(indexer.from_counters(totals))
+    changed, removed = index_cache.outdated_files(sortBySizeDescending(xliffs.keys()))
+    print("Incremental index: {} changed and {} removed files".format(len(changed), len(removed)))
+    # Remove the old contributions
+    for filename in removed + changed:
+        if index_cache.is_cached(filename):
+            indexer.subtract(indexer.from_counters(index_cache.load_shard(filename)))
+    for filename in removed:
+        index_cache.remove_shard(filename)
+    # Add the new ones
+    futures = [
+        executor.submit(index_xliff_files, lang, indexer.new_shard(), batch)
+        for batch in split_by_size(changed, num_batches)
+    ]
+    for future in tqdm(futures, unit="batch"):
+        for filename, counters in future.result():
+            indexer.merge(indexer.from_counters(counters))
+            index_cache.store_shard(filename, counters)
+    if totals is None or changed or removed:
+        # Don't keep the paths of removed files in the file table
+        indexer.compact_files()
+        index_cache.write(indexer.counters())
+
 def autotranslate_xliffs(args):
     # Plausibility checks
     if args.full_auto and args.approve:
@@ -221,9 +387,14 @@ def autotranslate_xliffs(args):
     ignore_alltranslated = args.index_ignore_translated
 
     # Initialize pattern indexers
-    text_tag_indexer = TextTagIndexer(args.language) if args.index else None
+    # One table of file IDs for the filename indices of all indexers
+    file_table = FileTable()
+    text_tag_indexer = TextTagIndexer(args.language, files=file_table) if args.index else None
     pattern_indexer = None #GenericPatternIndexer() if args.index else None
-    ignore_formula_pattern_idxer = IgnoreFormulaPatternIndexer(args.language) if args.index else None
+    ignore_formula_pattern_idxer = IgnoreFormulaPatternIndexer(args.language,
+        single_pass=args.single_pass, sketch_width=args.sketch_width,
+        max_pending=args.max_pending, unfiltered=args.incremental,
+        files=file_table) if args.index else None
     indexer = CompositeIndexer(text_tag_indexer, pattern_indexer, ignore_formula_pattern_idxer)
 
     # Initialize autotranslators
@@ -233,41 +404,58 @@ def autotranslate_xliffs(args):
         ifpattern_autotranslator = IFPatternAutotranslator(args.language) if args.patterns else None
         name_autotranslator = NameAutotranslator(args.language) if args.name_autotranslate else None
         autotranslator = CompositeAutoTranslator(rule_autotranslator,
-            full_autotranslator, name_autotranslator, ifpattern_autotranslator)
+            full_autotranslator, name_autotranslator, ifpattern_autotranslator,
+            result_cache=args.result_cache)
     else: # Index, not autotranslate
         autotranslator = CompositeAutoTranslator()
 
-    # Process in parallel
-    # Cant use process pool as indexers currently cant be merged
-    executor = concurrent.futures.ThreadPoolExecutor(args.num_processes)
-
-    xliffs = findXLIFFFiles("cache/{}".format(args.language), filt=args.filter)
-
+    # Process in parallel. Indexing runs on a process pool with
+    # one indexer shard per batch, translation (I/O bound) in threads
     if args.index:
+        executor = concurrent.futures.ProcessPoolExecutor(args.num_processes)
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(args.num_processes)
+
+    xliffs = findXLIFFFiles("cache/{}".format(args.language), filt=args.filter, lang=args.language)
+
+    # Several batches per process to balance the load
+    num_batches = args.num_processes * 4
+    if args.index and args.incremental:
+        index_cache = IndexCache(args.language, ignore_formula_pattern_idxer.texttags)
+        run_incremental_index(executor, xliffs, args.language, indexer, num_batches, index_cache)
+    elif args.index and args.single_pass:
+        # Patterns are admitted online, see IgnoreFormulaPatternIndexer
+        run_index(executor, xliffs, args.language, indexer, num_batches, preindex=False)
+        if ignore_formula_pattern_idxer.pending_dropped:
+            print(red("Pending list full: Dropped {} occurrences, pattern counts may be too low by up to {} per batch".format(
+                ignore_formula_pattern_idxer.pending_dropped,
+                ignore_formula_pattern_idxer.preindex_min_count - 1)))
+    elif args.index:
         # Two pass: First preindex then
         # See IgnoreFormulaPatternIndex for reason
         # 1st pass
-        run(executor, xliffs, lang=args.language, indexer=indexer, autotranslator=autotranslator, upload=args.upload, approve=args.approve, autotranslate=False, preindex=True, overwrite=args.overwrite, fullauto_account=args.full_auto)
+        run_index(executor, xliffs, args.language, indexer, num_batches, preindex=True)
         print("------------------------------")
         print("Preindex finished. Indexing run")
         print("------------------------------\n")
         indexer.clean_preindex()
         print()
-        run(executor, xliffs, lang=args.language, indexer=indexer, autotranslator=autotranslator, upload=args.upload, approve=args.approve, autotranslate=False, preindex=False, overwrite=args.overwrite, fullauto_account=args.full_auto)
+        run_index(executor, xliffs, args.language, indexer, num_batches, preindex=False)
     else: # translation run. Simple single pas
         autotranslated_count = run(executor, xliffs,
             lang=args.language, indexer=indexer, autotranslator=autotranslator, upload=args.upload, approve=args.approve, autotranslate=True, overwrite=args.overwrite, fullauto_account=args.full_auto)
         print("\nAuto-translated {} strings !\n".format(autotranslated_count))
+    executor.shutdown()
+    autotranslator.close()
 
     # Export indexed
     if args.index:
         print("Exporting indices...")
-        text_tag_indexer.exportJSON(ignore_alltranslated)
-        text_tag_indexer.exportXLIFF(ignore_alltranslated)
-        text_tag_indexer.exportXLSX(ignore_alltranslated)
-        ignore_formula_pattern_idxer.exportJSON(ignore_alltranslated)
-        ignore_formula_pattern_idxer.exportXLSX(ignore_alltranslated)
-        ignore_formula_pattern_idxer.exportXLIFF(ignore_alltranslated)
+        # Reproducible file IDs, independent of the number of processes
+        indexer.compact_files()
+        file_table.exportJSON(args.language)
+        text_tag_indexer.export(ignore_alltranslated)
+        ignore_formula_pattern_idxer.export(ignore_alltranslated)
         #pattern_indexer.exportCSV(os.path.join("output-" + args.language, "patterns.csv"))
 
     if args.update_index_source:
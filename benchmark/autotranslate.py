@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of RuleAutotranslator on synthetic source strings.
+
+Compares the combined classifier (translate()) with evaluating every
+rule separately (reference_translate()), checks that both agree on every
+string and prints a machine-readable JSON report, e.g.:
+
+    python3 -m benchmark.autotranslate -n 100000 -o bench.json
+"""
+import os
+import sys
+import json
+import time
+
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repodir)
+
+from benchmark.corpus import SyntheticCorpus
+from benchmark.render import gitRevision
+
+def generateStrings(num_strings, seed, duplication):
+    corpus = SyntheticCorpus(seed, duplication)
+    return [corpus.source() for _ in range(num_strings)]
+
+def timeTranslate(fn, strings, repeat):
+    """Best wall time of repeat runs of fn over all strings"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for engl in strings:
+            fn(engl)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+def runBenchmark(args):
+    from AutoTranslationTranslator import RuleAutotranslator
+    trans = RuleAutotranslator()
+    strings = generateStrings(args.strings, args.seed, args.duplication)
+    mismatches = [engl for engl in strings
+                  if trans.translate(engl) != trans.reference_translate(engl)]
+    results = {}
+    for name, fn in (("classifier", trans.translate), ("reference", trans.reference_translate)):
+        seconds = timeTranslate(fn, strings, args.repeat)
+        results[name] = {
+            "seconds": seconds,
+            "strings_per_second": len(strings) / seconds if seconds else None
+        }
+    return {
+        "revision": gitRevision(),
+        "strings": len(strings),
+        "translated": sum(1 for engl in strings if trans.translate(engl) is not None),
+        "seed": args.seed,
+        "duplication": args.duplication,
+        "repeat": args.repeat,
+        "mismatches": mismatches[:20],
+        "num_mismatches": len(mismatches),
+        "results": results,
+        "speedup": results["reference"]["seconds"] / results["classifier"]["seconds"]
+    }
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--strings', type=int, default=50000, help='Number of source strings')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Number of timed runs (the best one is reported)')
+    parser.add_argument('--duplication', type=float, default=0.3, help='Fraction of duplicated source strings')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the strings')
+    parser.add_argument('-o', '--output', help='Write the JSON report to this file (default: stdout)')
+    args = parser.parse_args()
+
+    report = runBenchmark(args)
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump(report, outfile, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+    if report["num_mismatches"]:
+        sys.exit(1)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Generator for synthetic Crowdin-style XLIFF trees.
+
+The generated tree mimics a downloaded translation cache (cache/<lang>/...)
+including formulas, Perseus widgets, image URLs and long notes,
+so renders can be benchmarked without a Crowdin download.
+"""
+import os
+import json
+import random
+from xml.sax.saxutils import escape, quoteattr
+
+_words = ["the", "value", "of", "a", "triangle", "is", "equal", "to", "school", "red",
+          "green", "purple", "line", "slope", "area", "number", "what", "lower", "graph",
+          "point", "miles", "terms", "angle", "circle", "sum", "each", "how", "many"]
+
+_widgets = ["numeric-input", "expression", "radio", "input-number", "dropdown", "image"]
+
+_directories = ["2_high_priority_content/math/early-math",
+                "2_high_priority_content/math/algebra",
+                "2_high_priority_content/math/geometry",
+                "2_high_priority_content/science/physics",
+                "1_high_priority_platform",
+                "4_low_priority"]
+
+_xliffHeader = '<?xml version="1.0" encoding="UTF-8"?>\n' \
+    '<xliff xmlns="urn:oasis:names:tc:xliff:document:1.2" version="1.2">\n' \
+    '  <file id="{fileid}" original="{original}" source-language="en-US" target-language="{lang}" datatype="plaintext">\n' \
+    '    <body>\n'
+_xliffFooter = '    </body>\n  </file>\n</xliff>\n'
+
+class SyntheticCorpus(object):
+    """
+    Generates realistic-looking source strings and pseudo-translations.
+
+    duplication is the fraction of units whose source string
+    is copied from an earlier unit (as in real exercise files).
+    """
+    def __init__(self, seed=0, duplication=0.3, untranslated=0.2, note_length=600):
+        self.rng = random.Random(seed)
+        self.duplication = duplication
+        self.untranslated = untranslated
+        self.note_length = note_length
+        self.sources = []
+
+    def sentence(self, n=None):
+        n = n or self.rng.randint(3, 14)
+        s = " ".join(self.rng.choice(_words) for _ in range(n))
+        return s[0].upper() + s[1:] + self.rng.choice([".", "?", ":", ""])
+
+    def formula(self):
+        a, b, c = (self.rng.randint(1, 999) for _ in range(3))
+        return self.rng.choice([
+            "${}x + {} = {}$".format(a, b, c),
+            "$\\\\dfrac{{{}}}{{{}}}$".format(a, b),
+            "$\\\\blue{{{}}}\\\\text{{ cm}}$".format(a),
+            "$\\\\text{{{}}} = {}$".format(self.rng.choice(_words), c),
+            "${}\\\\,{}$".format(a, b)])
+
+    def image(self):
+        h = "%040x" % self.rng.getrandbits(160)
+        return self.rng.choice([
+            "![](https://ka-perseus-graphie.s3.amazonaws.com/{}.png)".format(h),
+            "![](web+graphie://ka-perseus-graphie.s3.amazonaws.com/{})".format(h),
+            "https://ka-perseus-images.s3.amazonaws.com/{}.svg".format(h)])
+
+    def widget(self):
+        return "[[☃ {} {}]]".format(self.rng.choice(_widgets), self.rng.randint(1, 3))
+
+    def source(self):
+        if self.sources and self.rng.random() < self.duplication:
+            return self.rng.choice(self.sources)
+        kind = self.rng.random()
+        if kind < 0.15:
+            s = self.formula()
+        elif kind < 0.25:
+            s = self.image()
+        elif kind < 0.35:
+            s = "{} {}\\n\\n{}".format(self.sentence(), self.formula(), self.widget())
+        elif kind < 0.45:
+            s = "{}\\n\\n{}".format(self.sentence(), self.image())
+        elif kind < 0.6:
+            s = "{} {} {}".format(self.sentence(), self.formula(), self.sentence())
+        else:
+            s = " ".join(self.sentence() for _ in range(self.rng.randint(1, 4)))
+        self.sources.append(s)
+        return s
+
+    def translate(self, s):
+        """Pseudo-translate: Uppercase some words, keep others (=> rule hits)"""
+        return " ".join(w.upper() if self.rng.random() < 0.7 and w.isalpha() else w
+                        for w in s.split(" "))
+
+    def note(self, path):
+        slug = os.path.basename(path).replace(".xliff", "")
+        s = "Exercise: https://www.khanacademy.org/math/{0}/e/{0}\\n".format(slug)
+        while len(s) < self.note_length:
+            s += self.sentence() + " "
+        return s
+
+    def trans_unit(self, uid, note):
+        source = self.source()
+        approved = ""
+        if self.rng.random() < self.untranslated:
+            target = '<target state="needs-translation">{}</target>'.format(escape(source))
+        else:
+            target = '<target state="translated">{}</target>'.format(escape(self.translate(source)))
+            if self.rng.random() < 0.5:
+                approved = ' approved="yes"'
+        return '      <trans-unit id="{}"{}>\n        <source>{}</source>\n        {}\n        <note>{}</note>\n      </trans-unit>\n'.format(
+            uid, approved, escape(source), target, escape(note))
+
+    def write_file(self, filename, lang, fileid, num_units, first_uid):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        note = self.note(filename)
+        with open(filename, "w") as outfile:
+            outfile.write(_xliffHeader.format(fileid=fileid, lang=lang,
+                original=quoteattr(os.path.basename(filename))[1:-1]))
+            for uid in range(first_uid, first_uid + num_units):
+                outfile.write(self.trans_unit(uid, note))
+            outfile.write(_xliffFooter)
+
+def generateCorpus(directory, languages, num_files=100, units_per_file=80, seed=0, duplication=0.3, untranslated=0.2, note_length=600):
+    """
+    Generate <directory>/cache/<lang>/... for every language plus the
+    translation filemaps. File sizes follow a long-tailed distribution
+    (a few very large exercise files), like the real corpus.
+
+    Returns a dict with statistics about the generated corpus.
+    """
+    cachedir = os.path.join(directory, "cache")
+    os.makedirs(cachedir, exist_ok=True)
+    # Same layout for every language, like on Crowdin
+    rng = random.Random(seed)
+    layout = [] # (path, fileid, num_units)
+    for fileid in range(num_files):
+        path = os.path.join(rng.choice(_directories), "file-{}.xliff".format(fileid))
+        num_units = max(1, int(rng.paretovariate(1.5) * units_per_file / 3))
+        layout.append((path, fileid, num_units))
+    stats = {"files": num_files, "units": 0, "bytes": 0}
+    for lang in languages:
+        corpus = SyntheticCorpus(seed, duplication, untranslated, note_length)
+        uid = 0
+        for path, fileid, num_units in layout:
+            filename = os.path.join(cachedir, lang, path)
+            corpus.write_file(filename, lang, fileid, num_units, uid)
+            uid += num_units
+            stats["units"] += num_units
+            stats["bytes"] += os.path.getsize(filename)
+        # Filemap, as downloaded by UpdateAllFiles
+        with open(os.path.join(cachedir, "translation-filemap-{}.json".format(lang)), "w") as outfile:
+            json.dump({
+                os.path.basename(path).replace(".xliff", ".pot"): {
+                    "id": fileid, "path": path.replace(".xliff", ".pot")}
+                for path, fileid, _ in layout
+            }, outfile)
+    return stats
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directory', help='The directory to create the cache/ tree in')
+    parser.add_argument('-l', '--languages', default="de", help='Comma-separated list of languages to generate')
+    parser.add_argument('-n', '--files', type=int, default=100, help='Number of XLIFF files per language')
+    parser.add_argument('-u', '--units', type=int, default=80, help='Average number of trans-units per file')
+    parser.add_argument('--duplication', type=float, default=0.3, help='Fraction of duplicated source strings')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    print(json.dumps(generateCorpus(args.directory, args.languages.split(","),
+        args.files, args.units, args.seed, args.duplication)))
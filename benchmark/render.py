@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+End-to-end render benchmark on a synthetic corpus.
+
+Generates a synthetic XLIFF tree (see benchmark.corpus), runs JSONHitRenderer
+with each language's rules and prints a machine-readable JSON report with
+throughput, peak RSS and per-stage timings, e.g.:
+
+    python3 -m benchmark.render -l de,sv-SE -n 200 -o bench.json
+
+Every language is rendered in a fresh process, so its peak RSS
+does not include the memory used for the previous languages.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import tempfile
+import datetime
+import subprocess
+
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repodir)
+
+from benchmark.corpus import generateCorpus
+
+def peakRSS(who=resource.RUSAGE_SELF):
+    """Peak resident set size of this process (or its largest child) in KiB"""
+    return resource.getrusage(who).ru_maxrss
+
+def gitRevision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=repodir,
+            stderr=subprocess.DEVNULL).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class StageTimer(object):
+    """Records the wall time of consecutive named stages"""
+    def __init__(self):
+        self.stages = {}
+    def run(self, name, fn, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.stages[name] = time.perf_counter() - start
+        return result
+
+def benchmarkLanguage(lang, units, num_processes):
+    # Imported here as check reads the cache directory on import
+    from check import JSONHitRenderer, findXLIFFFiles
+    timer = StageTimer()
+    renderer = timer.run("load_rules", JSONHitRenderer, "output", lang, num_processes)
+    xliffs = timer.run("find_files", findXLIFFFiles, os.path.join("cache", lang), lang=lang)
+    timer.run("compute", renderer.computeRuleHitsForFileSet, xliffs)
+    timer.run("export", renderer.exportHitsAsJSON)
+    timer.run("stats", renderer.writeStatsJSON)
+    renderer.executor.shutdown()
+    renderSeconds = timer.stages["compute"] + timer.stages["export"] + timer.stages["stats"]
+    return {
+        "files": len(xliffs),
+        "units": units,
+        "hits": sum(renderer.totalStatsByRule.values()),
+        "rules": len(renderer.rules),
+        "stages": timer.stages,
+        "units_per_second": units / renderSeconds if renderSeconds else None,
+        "peak_rss_kib": peakRSS()
+    }
+
+def benchmarkLanguageProcess(lang, units, num_processes, workdir):
+    """Run benchmarkLanguage() in a fresh process in the corpus directory"""
+    with tempfile.NamedTemporaryFile(suffix=".json") as resultFile:
+        # The renderer output must not end up in the report on stdout
+        subprocess.check_call([sys.executable, os.path.abspath(__file__),
+            "--render-language", lang, "--render-units", str(units),
+            "-j", str(num_processes), "-o", resultFile.name],
+            cwd=workdir, stdout=sys.stderr)
+        with open(resultFile.name) as infile:
+            return json.load(infile)
+
+def runBenchmark(args):
+    languages = args.languages.split(",")
+    workdir = args.workdir or tempfile.mkdtemp(prefix="katc-bench-")
+    os.makedirs(os.path.join(workdir, "cache"), exist_ok=True)
+    # Reuse the language map so the benchmark does not need to fetch it
+    languagesJSON = os.path.join(repodir, "cache", "languages.json")
+    if os.path.isfile(languagesJSON):
+        shutil.copyfile(languagesJSON, os.path.join(workdir, "cache", "languages.json"))
+    start = time.perf_counter()
+    corpus = generateCorpus(workdir, languages, args.files, args.units,
+        args.seed, args.duplication)
+    generateSeconds = time.perf_counter() - start
+    # Every language has the same layout
+    units = corpus["units"] // len(languages)
+    results = {}
+    for lang in languages:
+        print("Benchmarking {}...".format(lang), file=sys.stderr)
+        results[lang] = benchmarkLanguageProcess(lang, units, args.num_processes, workdir)
+    totalSeconds = time.perf_counter() - start - generateSeconds
+    report = {
+        "revision": gitRevision(),
+        "timestamp": datetime.datetime.now().isoformat(),
+        "corpus": dict(corpus, seed=args.seed, duplication=args.duplication,
+                       generate_seconds=generateSeconds),
+        "num_processes": args.num_processes,
+        "languages": results,
+        "total": {
+            "seconds": totalSeconds,
+            "units_per_second": sum(r["units"] for r in results.values()) / totalSeconds,
+            # Largest peak of all languages
+            "peak_rss_kib": peakRSS(resource.RUSAGE_CHILDREN)
+        }
+    }
+    if not args.workdir:
+        shutil.rmtree(workdir)
+    return report
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-l', '--languages', default="de", help='Comma-separated list of languages whose rules to benchmark')
+    parser.add_argument('-n', '--files', type=int, default=100, help='Number of XLIFF files per language')
+    parser.add_argument('-u', '--units', type=int, default=80, help='Average number of trans-units per file')
+    parser.add_argument('--duplication', type=float, default=0.3, help='Fraction of duplicated source strings')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the corpus')
+    parser.add_argument('-j', '--num-processes', default=2, type=int, help='Number of threads to use for parallel processing')
+    parser.add_argument('-w', '--workdir', help='Keep corpus and output in this directory (default: temporary directory)')
+    parser.add_argument('-o', '--output', help='Write the JSON report to this file (default: stdout)')
+    # Internal: Benchmark a single language in the current (corpus) directory
+    parser.add_argument('--render-language', help=argparse.SUPPRESS)
+    parser.add_argument('--render-units', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.render_language:
+        report = benchmarkLanguage(args.render_language, args.render_units, args.num_processes)
+    else:
+        report = runBenchmark(args)
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump(report, outfile, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
@@ -23,18 +23,50 @@ import datetime
 import functools
 import concurrent.futures
 import collections
+import sys
+import time
+import math
+import zlib
 from XLIFFReader import *
 from toolz.dicttoolz import valfilter, merge, merge_with, keyfilter, valmap
 from toolz.itertoolz import groupby, reduceby
 from multiprocessing import Pool
 from ansicolor import red, black, blue
+from lxml.etree import XMLSyntaxError
 from UpdateAllFiles import get_translation_urls
-from Rules import Severity, importRulesForLanguage
+from Rules import Severity, importRulesForLanguage, cleanupTranslatedString, extractImages, \
+    CorpusRule, TranslationConsistencyRule
 from LintReport import readAndMapLintEntries, NoResultException
 from AutoTranslateCommon import to_crowdin_search_string
+from SearchIndex import SearchIndex
 
 XLIFFEntry = collections.namedtuple("XLIFFEntry", ["id", "english", "translated", "is_untranslated", "note"])
 
+class RuleHit(object):
+    """
+    Compact record of a single rule hit.
+
+    Notes are not stored here but read from the XLIFF file at output time
+    (see JSONHitRenderer.noteOffsets). Images are extracted at output time.
+    """
+    __slots__ = ["filename", "id", "english", "translated", "hit"]
+
+    def __init__(self, filename, id, english, translated, hit):
+        self.filename = filename
+        self.id = id
+        self.english = english
+        self.translated = translated
+        self.hit = hit
+
+# English source strings are the same for every language. When rendering
+# multiple languages in one process, their image lists are only computed once.
+extractEnglishImages = functools.lru_cache(maxsize=65536)(extractImages)
+# Notes are requested for both the per-file and the overview output.
+# version is only part of the cache key, see JSONHitRenderer.noteVersions
+@functools.lru_cache(maxsize=4096)
+def readNoteCached(filename, start, end, version=0):
+    return read_note(filename, start, end)
+
 def writeToFile(filename, s):
     "Utility function to write a string to a file identified by its filename"
     with open(filename, "w") as outfile:
@@ -45,6 +77,20 @@ def writeJSONToFile(filename, obj):
     with open(filename, "w") as outfile:
         json.dump(obj, outfile)
 
+def listPageFiles(directory):
+    """
+    Get a rule machine name => [filename] map of the hit pages
+    (<rule>.page-<n>.json) in the given directory
+    """
+    pageFiles = collections.defaultdict(list)
+    if not os.path.isdir(directory):
+        return pageFiles
+    for filename in os.listdir(directory):
+        ruleName, sep, _ = filename.rpartition(".page-")
+        if sep and filename.endswith(".json"):
+            pageFiles[ruleName].append(filename)
+    return pageFiles
+
 def findPOFiles(directory):
     """
     Get a list of PO files (.po / .pot) which are present in the directory.
@@ -68,16 +114,35 @@ class JSONHitRenderer(object):
     """
     A state container for the code which applies rules and generates HTML.
     """
-    def __init__(self, outdir, lang="de", num_processes=2):
+    def __init__(self, outdir, lang="de", num_processes=2, executor=None, sample_rate=None, rule_names=None):
         self.lang = lang
         # Create output directory
         self.outdir = os.path.join(outdir, lang)
         os.makedirs(self.outdir, exist_ok=True)
-        # Async executor
-        self.executor = concurrent.futures.ThreadPoolExecutor(num_processes)
+        # Async executor. May be shared between multiple renderers.
+        self.executor = executor or concurrent.futures.ThreadPoolExecutor(num_processes)
         # Load rules for language
         rules, rule_errors = importRulesForLanguage(lang)
-        self.rules = sorted(rules, reverse=True)
+        # Pseudo-rule comparing the translations across all files.
+        # Its hits can't be estimated from a sample
+        corpusRules = [] if sample_rate else [TranslationConsistencyRule()]
+        self.rules = sorted(list(rules) + corpusRules, reverse=True)
+        # Only evaluate these rules (given by machine name). The results
+        # of the other rules are taken from the previous render in outdir
+        self.selectedRules = None
+        self.evaluatedRules = self.rules
+        if rule_names:
+            rulesByName = {rule.machine_name: rule for rule in self.rules}
+            unknown = set(rule_names) - set(rulesByName)
+            if unknown:
+                raise ValueError("Unknown rules for {}: {}".format(lang, ", ".join(sorted(unknown))))
+            self.selectedRules = {rulesByName[name] for name in rule_names}
+            self.evaluatedRules = [rule for rule in self.rules if rule in self.selectedRules]
+        self.corpusRules = [rule for rule in self.evaluatedRules if isinstance(rule, CorpusRule)]
+        # Corpus rule => {filename: record of the file} (see CorpusRule).
+        # Kept for watch mode, so this grows with the corpus: About 350 bytes
+        # per distinct string of every file for TranslationConsistencyRule
+        self.corpusRecords = {rule: {} for rule in self.corpusRules}
         self.rule_errors = rule_errors
         # Get timestamp
         self.timestamp = datetime.datetime.now().strftime("%y-%m-%d %H:%M:%S")
@@ -90,49 +155,135 @@ class JSONHitRenderer(object):
             self.downloadTimestamp = None
         # Initialize translation ID/URL map
         self.translationURLs = get_translation_urls(lang)
+        # filename => {trans-unit id: note byte offsets}, only for entries with hits.
+        # Computed when the first note of a file is written
+        self.noteOffsets = {}
+        # filename => number of updates. Changes the note cache key of updated files
+        self.noteVersions = collections.Counter()
+        # Search index of the last overview, kept for updateFiles()
+        self.searchIndex = None
+        # Files with more trans-units are split into chunks processed in parallel
+        self.chunkSize = 2500
+        # Rules with more hits are written as multiple pages
+        self.pageSize = 1000
+        # Only evaluate this fraction of the trans-units and estimate the
+        # total number of hits (None => evaluate all trans-units)
+        self.sampleRate = sample_rate
 
     def file_relpath(self, filename):
         return os.path.relpath(filename, os.path.join("cache", self.lang))
 
-    def computeRuleHits(self, filename):
+    def xliffFilename(self, relpath):
+        return os.path.join("cache", self.lang, relpath)
+
+    def fileRules(self, relpath):
         """
-        Compute all rule hits for a single parsed PO file and return a list of hits
+        Resolve filename-dependent rules once for the whole file.
+        Returns a list of (rule, rule to apply) tuples
         """
-        # Compute relative path (which is how Crowin refers to the file)
-        relpath = self.file_relpath(filename)
-        # Read XLIFF
-        basename = os.path.basename(filename)
-        soup = parse_xliff_file(filename)
-        try:
-            body = soup.xliff.file.body
-        except AttributeError:
-            print(red("File {} is not valid XLIFF - Ignoring.".format(relpath)))
-            return []
-        # Iterate over all translatable strings and apply rule
-        rule_hits = defaultdict(list)
+        fileRules = [(rule, rule.for_file(relpath)) for rule in self.evaluatedRules]
+        return [(rule, fileRule) for rule, fileRule in fileRules if fileRule is not None]
+
+    def readXLIFFEntries(self, filename, readNotes=True):
+        """
+        Parse a XLIFF file into a list of XLIFFEntry objects.
+        If readNotes is False, the notes are left empty.
+        Returns None if the file is not valid XLIFF.
+        """
+        # Parse directly from the mapped file. Only the used fields are decoded
+        body = find_xliff_body(parse_xliff_tree(filename))
+        if body is None:
+            print(red("File {} is not valid XLIFF - Ignoring.".format(self.file_relpath(filename))))
+            return None
         print(filename)
-        for trans_unit in body.find_all("trans-unit"):
+        entries = []
+        for trans_unit in body.iter("{*}trans-unit"):
             # Extract info
-            source = trans_unit.source
-            target = trans_unit.target
+            source = trans_unit.find("{*}source")
+            target = trans_unit.find("{*}target")
             # Broken XLIFF entry
             if source is None or target is None:
                 continue
-            note = "" if trans_unit.note is None  else trans_unit.note.texts
+            note = trans_unit.find("{*}note") if readNotes else None
             # Convert to XLIFF entry
-            is_untranslated = ("state" in target.attrs and target["state"] == "needs-translation")
-            entry = XLIFFEntry(trans_unit["id"], source.text,
-                "" if is_untranslated else target.text,
-                is_untranslated, note)
+            is_untranslated = target.get("state") == "needs-translation"
+            entries.append(XLIFFEntry(trans_unit.get("id"), element_text(source),
+                "" if is_untranslated else element_text(target),
+                is_untranslated, "" if note is None else element_text(note)))
+        return entries
+
+    def computeRuleHitsForEntries(self, relpath, entries):
+        """
+        Apply all rules to a list of XLIFFEntry objects from the given file.
+        Returns a tuple (rule => hit list, corpus rule => record of the entries).
+        Corpus rules don't have hits yet (see addCorpusHits()).
+        """
+        rule_hits = {rule: [] for rule in self.evaluatedRules}
+        corpus_records = {}
+        file_rules = []
+        for rule, fileRule in self.fileRules(relpath):
+            if isinstance(rule, CorpusRule):
+                record = corpus_records[rule] = rule.new_record()
+                for entry in entries:
+                    rule.observe(record, entry)
+            else:  # Hits are stored for the original rule
+                file_rules.append((rule_hits[rule], fileRule))
+        for entry in entries:
             # Apply to rules
-            for rule in self.rules:
-                rule_hits[rule] += list(rule.apply_to_xliff_entry(entry, relpath))
-        # Convert to list which is easier to process down the chain
+            for hits, rule in file_rules:
+                for hit in rule.apply_to_xliff_entry(entry, relpath):
+                    hits.append(RuleHit(relpath, entry.id,
+                        entry.english, entry.translated, hit))
+        return rule_hits, corpus_records
+
+    def readFileEntries(self, relpath):
+        """
+        Read the entries of a file, including the notes only if any rule needs them
+        """
+        readNotes = any(rule.needs_tcomment for _, rule in self.fileRules(relpath))
+        entries = self.readXLIFFEntries(self.xliffFilename(relpath), readNotes)
+        if entries is not None and self.sampleRate:
+            entries = [entry for entry in entries if self.isSampled(relpath, entry.id)]
+        return entries
+
+    def isSampled(self, relpath, id):
+        """
+        Decide if a trans-unit is part of the sample. Every unit is selected
+        independently with probability self.sampleRate, i.e. the sample is
+        stratified by file and directory. The decision is based on a hash,
+        so repeated renders (e.g. while tuning a rule) use the same sample.
+        """
+        h = zlib.crc32("{}\x00{}".format(relpath, id).encode("utf-8"))
+        return h < self.sampleRate * 2**32
+
+    def computeRuleHits(self, filename):
+        """
+        Compute all rule hits for a single XLIFF file.
+        Returns a tuple (relpath, rule => hit list, corpus rule => record)
+        """
+        # Compute relative path (which is how Crowin refers to the file)
+        relpath = self.file_relpath(filename)
+        entries = self.readFileEntries(relpath)
+        if entries is None:
+            return relpath, {}, {}
+        rule_hits, corpus_records = self.computeRuleHitsForEntries(relpath, entries)
         gc.collect()
-        return [
-            (relpath, rule, hits)
-            for rule, hits in rule_hits.items()
-        ]
+        return relpath, rule_hits, corpus_records
+
+    def computeFirstChunkRuleHits(self, filename):
+        """
+        Like computeRuleHits(), but only processes the first self.chunkSize entries.
+        Returns a tuple (relpath, rule => hit list, corpus rule => record, remaining chunks)
+        so the remaining chunks can be processed in parallel.
+        """
+        relpath = self.file_relpath(filename)
+        entries = self.readFileEntries(relpath)
+        if entries is None:
+            return relpath, {}, {}, []
+        chunks = [entries[i:i + self.chunkSize]
+                  for i in range(0, len(entries), self.chunkSize)] or [[]]
+        rule_hits, corpus_records = self.computeRuleHitsForEntries(relpath, chunks[0])
+        return relpath, rule_hits, corpus_records, chunks[1:]
 
     def computeRuleHitsForFileSet(self, xliffs):
         """
@@ -142,49 +293,177 @@ class JSONHitRenderer(object):
         Stores the information in the current instance.
         Does not return anything
         """
+        self.collectRuleHits(self.submitRuleHits(xliffs))
+
+    def submitRuleHits(self, xliffs):
+        """
+        Submit the rule computation for all files to the executor
+        and return the list of futures (see collectRuleHits()).
+        """
         # Compute dict with sorted & prettified filenames
         self.files = sorted(xliffs.keys())
-        # Add all futures to the executor
-        futures = [self.executor.submit(self.computeRuleHits, filename)
-            for filename in xliffs.keys()]
+        # Add all futures to the executor. Largest files first so
+        # they don't end up as stragglers at the end of the run
+        return [self.executor.submit(self.computeFirstChunkRuleHits, filename)
+            for filename in sortBySizeDescending(xliffs.keys())]
+
+    def collectRuleHits(self, futures, corpusHits=True):
+        """
+        Wait for the futures from submitRuleHits() and compute the statistics.
+
+        Remaining chunks of large files are submitted as soon as
+        their file has been parsed and merged back once all are finished.
+        If corpusHits is False, only the records of the corpus rules are
+        collected (e.g. for shards, see mergeShards()).
+        """
         # Process the results in first-received order. Also keep track of rule performance
         self.fileRuleHits = collections.defaultdict(dict)
+        self.corpusRecords = {rule: {} for rule in self.corpusRules}
         n_finished = 0
         # Intermediate result storage
-        raw_results = collections.defaultdict(dict) # filename -> {rule: result}
-        for future in concurrent.futures.as_completed(futures):
-            # Extract result
-            for filename, rule, result in future.result():
-                self.fileRuleHits[filename][rule] = result
-            # Track progress
-            n_finished += 1
-            if n_finished % 1000 == 0:
-                percent_finished = n_finished * 100. / len(futures)
-                print("Rule computation finished {0:.2f} %".format(percent_finished))
+        chunkResults = {} # filename -> [(rule => hits, corpus rule => record) for every chunk]
+        chunkFutures = {} # future -> (filename, chunk index)
+        pending = set(futures)
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                # Extract result
+                if future in chunkFutures:
+                    filename, idx = chunkFutures.pop(future)
+                    chunkResults[filename][idx] = future.result()
+                    if any(result is None for result in chunkResults[filename]):
+                        continue  # Other chunks still running
+                    # Merge chunks in order. Only the evaluated rules are present,
+                    # the output of the other rules must be kept (see --rule)
+                    ruleHits = {}
+                    corpusRecords = {}
+                    for chunkHits, chunkRecords in chunkResults.pop(filename):
+                        for rule, hits in chunkHits.items():
+                            ruleHits.setdefault(rule, []).extend(hits)
+                        for rule, record in chunkRecords.items():
+                            if rule in corpusRecords:
+                                rule.merge_records(corpusRecords[rule], record)
+                            else:
+                                corpusRecords[rule] = record
+                    self.fileRuleHits[filename].update(ruleHits)
+                    self._storeCorpusRecords(filename, corpusRecords)
+                else:
+                    filename, ruleHits, corpusRecords, chunks = future.result()
+                    if chunks:  # Large file => process remaining chunks in parallel
+                        chunkResults[filename] = [(ruleHits, corpusRecords)] + [None] * len(chunks)
+                        for idx, chunk in enumerate(chunks, start=1):
+                            chunkFuture = self.executor.submit(
+                                self.computeRuleHitsForEntries, filename, chunk)
+                            chunkFutures[chunkFuture] = (filename, idx)
+                            pending.add(chunkFuture)
+                        continue
+                    self.fileRuleHits[filename].update(ruleHits)
+                    self._storeCorpusRecords(filename, corpusRecords)
+                # Track progress
+                n_finished += 1
+                if n_finished % 1000 == 0:
+                    percent_finished = n_finished * 100. / len(futures)
+                    print("Rule computation finished {0:.2f} %".format(percent_finished))
+        # Corpus-wide rules only produce hits once all files have been seen
+        if corpusHits:
+            self.addCorpusHits()
 
-        # Compute total stats by file
-        self.statsByFile = {
-            filename: merge(self.ruleHitsToSeverityCountMap(ruleHits), {
-                            "translation_url": self.translationURLs[filename]})
-            for filename, ruleHits in self.fileRuleHits.items()
-        }
         # Compute map filename -> {rule: numHits for rule}
         self.statsByFileAndRule = {
             filename: valmap(len, ruleHits)
             for filename, ruleHits in self.fileRuleHits.items()
         }
+        if self.selectedRules is not None:
+            self.readPreviousStats()
+        self.computeStats()
+
+    def _storeCorpusRecords(self, filename, corpusRecords):
+        for rule, record in corpusRecords.items():
+            self.corpusRecords[rule][filename] = record
+
+    def addCorpusHits(self):
+        """
+        Compute the hits of the corpus rules from self.corpusRecords and
+        add them to self.fileRuleHits, replacing any previous corpus hits.
+        The texts of the hit trans-units are only read from the files
+        whose hits changed. Returns the set of these files.
+        """
+        changed = set()
+        for rule, records in self.corpusRecords.items():
+            hitsByFile = groupby(0, rule.corpus_hits(records))
+            for filename in set(hitsByFile).union(
+                    filename for filename, fileHits in self.fileRuleHits.items() if fileHits.get(rule)):
+                hits = hitsByFile.get(filename, [])
+                oldHits = self.fileRuleHits[filename].get(rule, [])
+                if [(h.id, h.hit) for h in oldHits] == [(id, hit) for _, id, hit in hits]:
+                    continue
+                texts = self._readUnitTexts(filename, {id for _, id, _ in hits}) if hits else {}
+                self.fileRuleHits[filename][rule] = [RuleHit(filename, id, *texts[id], hit)
+                                                     for _, id, hit in hits if id in texts]
+                changed.add(filename)
+        return changed
+
+    def _readUnitTexts(self, relpath, ids):
+        try:
+            return read_unit_texts(self.xliffFilename(relpath), ids)
+        except FileNotFoundError:
+            print(red("Can't read the hits of the corpus rules in {} - Ignoring.".format(relpath)))
+            return {}
+
+    def readPreviousStats(self):
+        """
+        Add the statistics of the rules which have not been evaluated
+        to statsByFileAndRule, using the per-file index.json of the previous render.
+        """
+        rulesByName = {rule.machine_name: rule for rule in self.rules
+                       if rule not in self.selectedRules}
+        missing = 0
+        for filename, ruleStats in self.statsByFileAndRule.items():
+            indexPath = os.path.join(self.outdir, filename, "index.json")
+            if not os.path.isfile(indexPath):
+                missing += 1
+                continue
+            with open(indexPath) as infile:
+                for ruleInfo in json.load(infile)["stats"]:
+                    rule = rulesByName.get(ruleInfo["machine_name"])
+                    if rule is not None:
+                        ruleStats[rule] = ruleInfo["num_hits"]
+        if missing:
+            print(red("No previous results for {} files - only the selected rules are counted there".format(missing), bold=True))
+
+    def computeStats(self):
+        """
+        Compute the per-file and total statistics from self.statsByFileAndRule
+        """
+        # Compute total stats by file
+        self.statsByFile = {
+            filename: merge(self.ruleStatsToSeverityCountMap(ruleStats), {
+                            "translation_url": self.translationURLs[filename]})
+            for filename, ruleStats in self.statsByFileAndRule.items()
+        }
         # Compute map rule -> numHits for rule
         self.totalStatsByRule = merge_with(sum, *(self.statsByFileAndRule.values()))
+        # For sampled renders: Sum of the squared number of hits per
+        # trans-unit, required for the variance of the estimates
+        self.squaresByFileAndRule = {}
+        if self.sampleRate:
+            self.squaresByFileAndRule = {
+                filename: {rule: sum(n * n for n in collections.Counter(hit.id for hit in hits).values())
+                           for rule, hits in ruleHits.items()}
+                for filename, ruleHits in self.fileRuleHits.items()
+            }
+        self.totalSquaresByRule = merge_with(sum, *(self.squaresByFileAndRule.values()))
 
-    def ruleHitsToSeverityCountMap(self, rule_hit_map):
+    def ruleStatsToSeverityCountMap(self, rule_stats):
         """
-        In a rule -> hitlist mapping, count the total number of hits above or at a given severity
+        In a rule -> number of hits mapping, count the total number of hits above or at a given severity
         level and return a cumulative dictionary
         """
         # Create a map severity -> count
         severity_counts = collections.defaultdict(int)
-        for rule, hits in rule_hit_map.items():
-            severity_counts[rule.severity] += len(hits)
+        for rule, count in rule_stats.items():
+            severity_counts[rule.severity] += count
         # Create string severity -> count map
         above_severity = lambda sev: sum(keyfilter(lambda k: k >= sev, severity_counts).values())
         return {"hits": above_severity(Severity.standard),
@@ -193,84 +472,394 @@ class JSONHitRenderer(object):
                 "infos": above_severity(Severity.info),
                 "notices": above_severity(Severity.notice)}
 
-    def countRuleHitsAboveSeverity(self, ruleHits, severity):
-        return sum((len(hits) for rule, hits in ruleHits.items() if rule.severity >= severity))
-
     def writeStatsJSON(self):
         """
         Write a statistics-by-filename JSON to outdir/filestats.sjon
         """
         # Write file
         stats = {
-            filename: {"hits": self.countRuleHitsAboveSeverity(ruleHits, Severity.standard),
-                       "warnings": self.countRuleHitsAboveSeverity(ruleHits, Severity.warning),
-                       "errors": self.countRuleHitsAboveSeverity(ruleHits, Severity.dangerous),
-                       "infos": self.countRuleHitsAboveSeverity(ruleHits, Severity.info),
-                       "notices": self.countRuleHitsAboveSeverity(ruleHits, Severity.notice)}
-            for filename, ruleHits in self.fileRuleHits.items()
+            filename: keyfilter(lambda k: k != "translation_url", fileStats)
+            for filename, fileStats in self.statsByFile.items()
         }
         writeJSONToFile(os.path.join(self.outdir, "filestats.json"), stats)
 
-    def _renderDirectory(self, ruleHits, ruleStats, directory, filename):
-        # Generate output HTML for each rule
-        for rule, hits in ruleHits.items():
-            # Render hits for individual rule
-            outfilePathJSON = os.path.join(directory, rule.machine_name + ".json")
-            if len(hits) > 0:  # Render hits
-                # Generate JSON API
-                jsonAPI = {
-                    "timestamp": self.timestamp,
-                    "downloadTimestamp": self.downloadTimestamp,
-                    "rule": rule.meta_dict,
-                    # valfilter: remove empty values for smaller JSON
-                    "hits": [valfilter(bool, {"msgstr": entry.translated,
-                                              "msgid": entry.english,
-                                              "tcomment": entry.note,
-                                              "hit": hit,
-                                              "origImages": origImages,
-                                              "translatedImages": translatedImages,
-                                              "crowdinLink": "{}#{}".format(self.translationURLs[filename], entry.id)
-                                              })
-                             for entry, hit, filename, origImages, translatedImages in hits]
-                }
-                writeJSONToFile(outfilePathJSON, jsonAPI)
-            else:  # Remove file (redirects to 404 file) if there are no exportHitsAsJSON
-                if os.path.isfile(outfilePathJSON):
-                    os.remove(outfilePathJSON)
-        # Render file index page (no filelist)
-        ruleInfos = [merge(rule.meta_dict, {"num_hits": ruleStats[rule]})
-                     for rule in self.rules if ruleStats[rule] > 0]
+    def _hitToJSON(self, hit):
+        """Convert a RuleHit to its JSON API representation"""
+        # valfilter: remove empty values for smaller JSON
+        return valfilter(bool, {"msgstr": hit.translated,
+                                "msgid": hit.english,
+                                "tcomment": self._note(hit.filename, hit.id),
+                                "hit": hit.hit,
+                                "origImages": extractEnglishImages(hit.english),
+                                "translatedImages": extractImages(cleanupTranslatedString(hit.translated)),
+                                "crowdinLink": "{}#{}".format(self.translationURLs[hit.filename], hit.id)
+                                })
+
+    def _note(self, relpath, id):
+        """
+        Read the note of a trans-unit with hits from its XLIFF file.
+        The note offsets of all units with hits are found by one scan per file.
+        """
+        offsets = self.noteOffsets.get(relpath)
+        if offsets is None:
+            ids = {hit.id for hits in self.fileRuleHits[relpath].values() for hit in hits}
+            offsets = self.noteOffsets[relpath] = find_note_offsets(self.xliffFilename(relpath), ids)
+        if id not in offsets:
+            return None
+        return readNoteCached(self.xliffFilename(relpath), *offsets[id], self.noteVersions[relpath])
+
+    def _writeRuleHits(self, rule, numHits, hitsJSON, directory, pageFiles=None):
+        """
+        Write the JSON API file for a single rule, given the number of hits
+        and an iterable of the hits in JSON form.
+
+        Rules with more than self.pageSize hits are split into pages
+        (<rule>.page-<n>.json). The <rule>.json file then only contains
+        a manifest with the page URLs. Only one page is kept in memory at a time.
+        pageFiles is a listPageFiles() result for directory, so it is only
+        listed once for all rules (default: list the directory).
+        """
+        outfilePathJSON = os.path.join(directory, rule.machine_name + ".json")
+        numPages = 0
+        if numHits > self.pageSize:  # Paginate
+            pageURLs = []
+            page = []
+            for hit in hitsJSON:
+                page.append(hit)
+                if len(page) == self.pageSize:
+                    pageURLs.append(self._writeRuleHitPage(rule, len(pageURLs) + 1, page, directory))
+                    page = []
+            if page:
+                pageURLs.append(self._writeRuleHitPage(rule, len(pageURLs) + 1, page, directory))
+            numPages = len(pageURLs)
+            writeJSONToFile(outfilePathJSON, {
+                "timestamp": self.timestamp,
+                "downloadTimestamp": self.downloadTimestamp,
+                "rule": rule.meta_dict,
+                "num_hits": numHits,
+                "page_size": self.pageSize,
+                "pages": pageURLs
+            })
+        elif numHits > 0:  # Render hits
+            # Generate JSON API
+            jsonAPI = {
+                "timestamp": self.timestamp,
+                "downloadTimestamp": self.downloadTimestamp,
+                "rule": rule.meta_dict,
+                "num_hits": numHits,
+                "hits": list(hitsJSON)
+            }
+            writeJSONToFile(outfilePathJSON, jsonAPI)
+        else:  # Remove file (redirects to 404 file) if there are no exportHitsAsJSON
+            if os.path.isfile(outfilePathJSON):
+                os.remove(outfilePathJSON)
+        # Remove pages left over from previous renders
+        if pageFiles is None:
+            pageFiles = listPageFiles(directory)
+        for pageFile in pageFiles.get(rule.machine_name, []):
+            pageNo = pageFile[:-len(".json")].rpartition(".page-")[2]
+            if not pageNo.isdigit() or int(pageNo) > numPages:
+                os.remove(os.path.join(directory, pageFile))
+
+    def _writeRuleHitPage(self, rule, pageNo, page, directory):
+        """Write a single page of hits. Returns its filename relative to directory"""
+        pageFilename = "{}.page-{}.json".format(rule.machine_name, pageNo)
+        writeJSONToFile(os.path.join(directory, pageFilename), {
+            "rule": rule.machine_name,
+            "page": pageNo,
+            "hits": page
+        })
+        return pageFilename
+
+    def _estimate(self, numHits, squares):
+        """
+        Horvitz-Thompson estimate of the number of hits in the full corpus
+        from the number of hits in the sample, with a 95% confidence interval.
+        squares is the sum of the squared number of hits per sampled trans-unit.
+        """
+        p = self.sampleRate
+        estimate = numHits / p
+        margin = 1.96 * math.sqrt((1 - p) / (p * p) * squares)
+        return {"estimated_hits": round(estimate),
+                "ci95": [max(numHits, math.floor(estimate - margin)),
+                         math.ceil(estimate + margin)]}
+
+    def _ruleInfos(self, ruleStats, ruleSquares={}):
+        ruleInfos = []
+        for rule in self.rules:
+            numHits = ruleStats.get(rule, 0)
+            if numHits == 0:
+                continue
+            ruleInfo = merge(rule.meta_dict, {"num_hits": numHits})
+            if self.sampleRate:  # num_hits only counts the sample
+                ruleInfo.update(self._estimate(numHits, ruleSquares.get(rule, 0)))
+            ruleInfos.append(ruleInfo)
         ruleInfos.sort(key=lambda o: -o["severity"])  # Invert sort order
+        return ruleInfos
+
+    def _writeIndex(self, ruleStats, directory):
+        # Render file index page (no filelist)
         js = {
             "pageTimestamp": self.timestamp,
             "downloadTimestamp": self.downloadTimestamp,
-            "stats": ruleInfos,
+            "stats": self._ruleInfos(ruleStats),
             "files": [merge(self.statsByFile[filename], {"filename": filename})
                       for filename in map(self.file_relpath, self.files)
                       if self.statsByFile[filename]["notices"] > 0]
         }
         writeJSONToFile(os.path.join(directory, "index.json"), js)
 
+    def computeDirectoryStats(self, statsByFileAndRule=None):
+        """
+        Aggregate statsByFileAndRule (or another filename => {rule: count} dict)
+        for every directory prefix (e.g. 2_high_priority_content/math) using a prefix tree:
+        Every file is added to its parent directory once, then every directory
+        is added to its parent, deepest directories first.
+
+        Returns directory => {rule: numHits}. The root directory is "".
+        """
+        if statsByFileAndRule is None:
+            statsByFileAndRule = self.statsByFileAndRule
+        dirStats = collections.defaultdict(collections.Counter)
+        for filename, ruleStats in statsByFileAndRule.items():
+            dirStats[os.path.dirname(filename)].update(ruleStats)
+        # Make sure intermediate directories without files exist
+        for directory in list(dirStats.keys()):
+            while directory:
+                directory = os.path.dirname(directory)
+                dirStats[directory]
+        for directory in sorted(dirStats.keys(), key=lambda d: -d.count("/")):
+            if directory:
+                dirStats[os.path.dirname(directory)].update(dirStats[directory])
+        return dirStats
+
+    def writeDirectoryRollups(self, filenames=None):
+        """
+        Write a rollup.json for every directory prefix, containing the
+        aggregated rule stats plus the stats of its subdirectories and files.
+        If filenames is given, only the directories containing these files are
+        written (and their rollup.json removed if no files are left in them).
+        """
+        dirStats = self.computeDirectoryStats()
+        directories = dirStats.keys()
+        if filenames is not None:
+            directories = set()
+            for directory in filenames:
+                while directory:
+                    directory = os.path.dirname(directory)
+                    directories.add(directory)
+        subdirectories = collections.defaultdict(list)
+        for directory in dirStats.keys():
+            if directory:
+                subdirectories[os.path.dirname(directory)].append(directory)
+        files = collections.defaultdict(list)
+        for filename in self.statsByFileAndRule.keys():
+            files[os.path.dirname(filename)].append(filename)
+        for directory in directories:
+            outdir = os.path.join(self.outdir, directory)
+            if directory not in dirStats:
+                if os.path.isfile(os.path.join(outdir, "rollup.json")):
+                    os.remove(os.path.join(outdir, "rollup.json"))
+                continue
+            ruleStats = dirStats[directory]
+            os.makedirs(outdir, exist_ok=True)
+            writeJSONToFile(os.path.join(outdir, "rollup.json"), {
+                "pageTimestamp": self.timestamp,
+                "downloadTimestamp": self.downloadTimestamp,
+                "directory": directory,
+                "stats": self._ruleInfos(ruleStats),
+                "directories": [merge(self.ruleStatsToSeverityCountMap(dirStats[subdir]), {"directory": subdir})
+                                for subdir in sorted(subdirectories[directory])],
+                "files": [merge(self.statsByFile[filename], {"filename": filename})
+                          for filename in sorted(files[directory])
+                          if self.statsByFile[filename]["notices"] > 0]
+            })
+
+    def writeEstimates(self):
+        """
+        For sampled renders, write the estimated number of hits per rule
+        for the whole corpus and every directory to outdir/estimates.json
+        and print the corpus estimates.
+        """
+        dirStats = self.computeDirectoryStats()
+        dirSquares = self.computeDirectoryStats(self.squaresByFileAndRule)
+        ruleInfos = self._ruleInfos(self.totalStatsByRule, self.totalSquaresByRule)
+        writeJSONToFile(os.path.join(self.outdir, "estimates.json"), {
+            "pageTimestamp": self.timestamp,
+            "sampleRate": self.sampleRate,
+            "stats": ruleInfos,
+            "directories": {directory: self._ruleInfos(ruleStats, dirSquares[directory])
+                            for directory, ruleStats in dirStats.items()}
+        })
+        for ruleInfo in ruleInfos:
+            print("{}: ~{} hits (95% CI {}-{}, {} in sample)".format(
+                ruleInfo["name"], ruleInfo["estimated_hits"], ruleInfo["ci95"][0],
+                ruleInfo["ci95"][1], ruleInfo["num_hits"]))
+
+    def _renderDirectory(self, ruleHits, ruleStats, directory, filename):
+        # Generate output HTML for each rule
+        pageFiles = listPageFiles(directory)
+        for rule, hits in ruleHits.items():
+            # Render hits for individual rule
+            self._writeRuleHits(rule, len(hits), (self._hitToJSON(hit) for hit in hits),
+                                directory, pageFiles)
+        self._writeIndex(ruleStats, directory)
+
+    def exportFileHitsAsJSON(self):
+        """
+        Write one output directory per file
+        """
+        for filename in self.fileRuleHits.keys():
+            self._renderFile(filename)
+
+    def _renderFile(self, filename):
+        rule_stats = self.statsByFileAndRule[filename]
+        # Ensure output directory is present
+        directory = os.path.join(self.outdir, filename)
+        os.makedirs(directory, exist_ok=True)
+        # Perform rendering
+        self._renderDirectory(self.fileRuleHits[filename], rule_stats, directory, filename)
+
+    def _renderOverview(self):
+        # Global hits for every rule, converted to JSON one page at a time
+        def ruleHitsJSON(rule):
+            if self.selectedRules is not None and rule not in self.selectedRules:
+                # Keep the previous hits
+                return [(None, self._readRuleHits(rule, self.outdir))]
+            return ((filename, map(self._hitToJSON, fileHits[rule]))
+                    for filename, fileHits in self.fileRuleHits.items() if fileHits.get(rule))
+        self._writeOverview(ruleHitsJSON, self.selectedRules)
+
+    def _readRuleHits(self, rule, directory):
+        """Yield the JSON hits of a rule written by _writeRuleHits(), one page at a time"""
+        rulePath = os.path.join(directory, rule.machine_name + ".json")
+        if not os.path.isfile(rulePath):
+            return
+        with open(rulePath) as infile:
+            ruleJSON = json.load(infile)
+        if "pages" not in ruleJSON:
+            yield from ruleJSON["hits"]
+            return
+        for pageFilename in ruleJSON["pages"]:
+            with open(os.path.join(directory, pageFilename)) as infile:
+                yield from json.load(infile)["hits"]
+
+    def _writeOverview(self, ruleHitsJSON, writeRules=None):
+        """
+        Write the global hit files, index and search index.
+        ruleHitsJSON(rule) must return an iterable of (filename or None, JSON hits)
+        segments of the hits of the rule.
+        Only the hit files of writeRules (default: all rules) are written,
+        the hits of the other rules are only added to the search index.
+        """
+        searchIndex = SearchIndex()
+        pageFiles = listPageFiles(self.outdir)
+        for rule in self.rules:
+            hitsJSON = itertools.chain.from_iterable(
+                searchIndex.index_hits(rule.machine_name, hits, filename)
+                for filename, hits in ruleHitsJSON(rule))
+            if writeRules is None or rule in writeRules:
+                self._writeRuleHits(rule, self.totalStatsByRule.get(rule, 0),
+                                    hitsJSON, self.outdir, pageFiles)
+            else:
+                collections.deque(hitsJSON, maxlen=0)  # Only index
+        searchIndex.write(os.path.join(self.outdir, "search"), self.pageSize)
+        self.searchIndex = searchIndex
+        self._writeIndex(self.totalStatsByRule, self.outdir)
+
     def exportHitsAsJSON(self):
         """
         Apply a rule and write a directory of output HTML files
         """
-        for filename, ruleHits in self.fileRuleHits.items():
-            rule_stats = self.statsByFileAndRule[filename]
-            # Ensure output directory is present
-            directory = os.path.join(self.outdir, filename)
-            os.makedirs(directory, exist_ok=True)
-            # Perform rendering
-            self._renderDirectory(ruleHits, rule_stats, directory, filename)
+        self.exportFileHitsAsJSON()
         #####################
         ## Render overview ##
         #####################
-        # Compute global hits for every rule
-        overview_hits = {
-            rule: list(itertools.chain(*(fileHits[rule] for fileHits in self.fileRuleHits.values())))
-            for rule in self.rules
-        }
-        self._renderDirectory(overview_hits, self.totalStatsByRule, self.outdir, filename="All files")
+        self._renderOverview()
+        self.writeDirectoryRollups()
+        self._writeStaticFiles()
+
+    def updateFiles(self, xliffs, removed=[]):
+        """
+        Incrementally update the output of a previous render:
+        Re-evaluate only the given files (filename => file ID dict,
+        e.g. files that changed on disk) and forget the removed files.
+
+        Re-renders only the directories of these files and of the files whose
+        corpus rule hits changed. Only their hits are replaced in the overview
+        and the search index, and only the rollups of their directories are written.
+        The file lists in the index.json of all other files are not updated.
+        """
+        # Evaluate the changed files before changing any state,
+        # so the update can be retried if a file can't be read
+        futures = [self.executor.submit(self.computeRuleHits, filename)
+            for filename in sortBySizeDescending(xliffs.keys())]
+        results = [future.result() for future in futures]
+        # Forget old results
+        for filename in removed:
+            relpath = self.file_relpath(filename)
+            self.fileRuleHits.pop(relpath, None)
+            self.statsByFileAndRule.pop(relpath, None)
+            for records in self.corpusRecords.values():
+                records.pop(relpath, None)
+            shutil.rmtree(os.path.join(self.outdir, relpath), ignore_errors=True)
+        self.files = sorted(set(self.files).difference(removed).union(xliffs))
+        for filename, ruleHits, corpusRecords in results:
+            self.fileRuleHits[filename] = ruleHits
+            self._storeCorpusRecords(filename, corpusRecords)
+        # The corpus rules compare all files => other files may be affected
+        updated = self.addCorpusHits().union(map(self.file_relpath, xliffs))
+        for filename in updated:
+            self.statsByFileAndRule[filename] = valmap(len, self.fileRuleHits[filename])
+        relpaths = updated.union(map(self.file_relpath, removed))
+        self.noteOffsets = keyfilter(lambda relpath: relpath not in relpaths, self.noteOffsets)
+        self.noteVersions.update(relpaths)
+        self.computeStats()
+        # Re-render
+        for filename in sorted(updated):
+            self._renderFile(filename)
+        self._updateOverview(relpaths)
+        self.writeDirectoryRollups(relpaths)
+        self.writeStatsJSON()
+
+    def _updateOverview(self, relpaths):
+        """
+        Replace the hits of the given files in the overview hit files and the
+        search index. The hits of all other files are copied from the previous
+        overview files, so their notes don't have to be read again.
+        """
+        pageFiles = listPageFiles(self.outdir)
+        for rule in self.rules:
+            segments = self.searchIndex.segments(rule.machine_name)
+            changed = [relpath for relpath in sorted(relpaths)
+                       if self.fileRuleHits.get(relpath, {}).get(rule)]
+            changed += [filename for filename, _ in segments
+                        if filename in relpaths and filename not in changed]
+            if not changed:
+                continue
+            # Read the previous hits before their pages are overwritten
+            previousHits = iter(list(self._readRuleHits(rule, self.outdir)))
+            def replacedHits(filename):
+                return self.searchIndex.replace_hits(rule.machine_name, filename,
+                    map(self._hitToJSON, self.fileRuleHits.get(filename, {}).get(rule, [])))
+            def ruleHitsJSON():
+                # Replace the hits in place, new files are appended
+                for filename, numHits in segments:
+                    hits = itertools.islice(previousHits, numHits)
+                    if filename in relpaths:
+                        collections.deque(hits, maxlen=0)
+                        hits = replacedHits(filename)
+                    yield from hits
+                known = {filename for filename, _ in segments}
+                for filename in changed:
+                    if filename not in known:
+                        yield from replacedHits(filename)
+            self._writeRuleHits(rule, self.totalStatsByRule.get(rule, 0), ruleHitsJSON(),
+                                self.outdir, pageFiles)
+        self.searchIndex.write(os.path.join(self.outdir, "search"), self.pageSize)
+        self._writeIndex(self.totalStatsByRule, self.outdir)
+
+    def _writeStaticFiles(self):
         # Create rule error file
         writeJSONToFile(os.path.join(self.outdir, "ruleerrors.json"),
                         [err.msg for err in self.rule_errors])
@@ -278,6 +867,105 @@ class JSONHitRenderer(object):
         for filename in glob.glob("templates/*"):
             shutil.copyfile(filename, os.path.join(self.outdir, os.path.split(filename)[-1]))
 
+    def shardDirectory(self, shard, num_shards):
+        return os.path.join(self.outdir, "shards", "{}-of-{}".format(shard, num_shards))
+
+    def exportShard(self, shard, num_shards):
+        """
+        Write the per-file output directories of this shard plus the
+        partial results needed by mergeShards() into the shard directory.
+        The hits of corpus-wide rules are computed by mergeShards()
+        from the records of all shards.
+        """
+        self.exportFileHitsAsJSON()
+        shardDir = self.shardDirectory(shard, num_shards)
+        os.makedirs(shardDir, exist_ok=True)
+        # Overview hits, already in JSON form
+        for rule in self.rules:
+            hitsJSON = [self._hitToJSON(hit)
+                        for fileHits in self.fileRuleHits.values()
+                        for hit in fileHits.get(rule, [])]
+            if hitsJSON:
+                writeJSONToFile(os.path.join(shardDir, rule.machine_name + ".json"), hitsJSON)
+        # Records of the corpus rules
+        for rule, records in self.corpusRecords.items():
+            writeJSONToFile(os.path.join(shardDir, rule.machine_name + ".records.json"),
+                            {filename: rule.record_to_json(record) for filename, record in records.items()})
+        # Statistics. Written last, so its presence marks a finished shard
+        writeJSONToFile(os.path.join(shardDir, "stats.json"), {
+            "files": self.files,
+            "stats": {
+                filename: {rule.machine_name: count for rule, count in ruleStats.items()}
+                for filename, ruleStats in self.statsByFileAndRule.items()
+            }
+        })
+
+    def _readShardHits(self, rule, shardDirs):
+        """Yield the JSON hits of the given rule from all shards, one shard at a time"""
+        for shardDir in shardDirs:
+            shardRuleFile = os.path.join(shardDir, rule.machine_name + ".json")
+            if os.path.isfile(shardRuleFile):
+                with open(shardRuleFile) as infile:
+                    yield from json.load(infile)
+
+    def mergeShards(self, num_shards):
+        """
+        Combine the partial results written by exportShard() for all shards
+        into the final per-file index, overview and filestats files.
+        The texts of the corpus rule hits are read from the XLIFF files.
+        """
+        rulesByName = {rule.machine_name: rule for rule in self.rules}
+        shardDirs = [self.shardDirectory(shard, num_shards) for shard in range(1, num_shards + 1)]
+        # Check if all shards have finished
+        missing = [shardDir for shardDir in shardDirs
+                   if not os.path.isfile(os.path.join(shardDir, "stats.json"))]
+        if missing:
+            raise ValueError("Shards not finished: {}".format(", ".join(missing)))
+        # Merge statistics
+        self.files = []
+        self.statsByFileAndRule = {}
+        for shardDir in shardDirs:
+            with open(os.path.join(shardDir, "stats.json")) as infile:
+                shardStats = json.load(infile)
+            self.files += shardStats["files"]
+            for filename, ruleStats in shardStats["stats"].items():
+                self.statsByFileAndRule[filename] = {
+                    rulesByName[name]: count for name, count in ruleStats.items()
+                    if name in rulesByName
+                }
+        self.files.sort()
+        # Corpus rules compare the files of all shards
+        self.fileRuleHits = collections.defaultdict(dict)
+        for rule in self.corpusRules:
+            for shardDir in shardDirs:
+                with open(os.path.join(shardDir, rule.machine_name + ".records.json")) as infile:
+                    for filename, record in json.load(infile).items():
+                        self.corpusRecords[rule][filename] = rule.record_from_json(record)
+        self.addCorpusHits()
+        for filename, ruleHits in self.fileRuleHits.items():
+            self.statsByFileAndRule[filename].update(valmap(len, ruleHits))
+            directory = os.path.join(self.outdir, filename)
+            pageFiles = listPageFiles(directory)
+            for rule, hits in ruleHits.items():
+                self._writeRuleHits(rule, len(hits), map(self._hitToJSON, hits),
+                                    directory, pageFiles)
+        self.computeStats()
+        # The file indices only know about files of their own shard => rewrite
+        for filename, ruleStats in self.statsByFileAndRule.items():
+            self._writeIndex(ruleStats, os.path.join(self.outdir, filename))
+        # Render overview by concatenating the shard hits
+        def ruleHitsJSON(rule):
+            if rule in self.corpusRecords:
+                return ((filename, map(self._hitToJSON, fileHits[rule]))
+                        for filename, fileHits in self.fileRuleHits.items() if fileHits.get(rule))
+            return [(None, self._readShardHits(rule, shardDirs))]
+        self._writeOverview(ruleHitsJSON)
+        self.writeDirectoryRollups()
+        self._writeStaticFiles()
+        self.writeStatsJSON()
+        # Shard results are not required any more
+        shutil.rmtree(os.path.join(self.outdir, "shards"))
+
 def renderLint(outdir, kalangcode):
     "Parse & render lint"
     # Map from KA code to crowdin code
@@ -306,6 +994,21 @@ def renderAllLints(outdir):
 def performRenderLint(args):
     renderAllLints("output")
 
+def parseShard(s):
+    """Parse a shard specification like "2/8" into a tuple (2, 8)"""
+    shard, _, num_shards = s.partition("/")
+    shard, num_shards = int(shard), int(num_shards)
+    if not 1 <= shard <= num_shards:
+        raise ValueError("Shard must be in 1..{}".format(num_shards))
+    return shard, num_shards
+
+def parseSample(s):
+    """Parse a sample rate like "5%" or "0.05" into a fraction"""
+    rate = float(s[:-1]) / 100. if s.endswith("%") else float(s)
+    if not 0 < rate <= 1:
+        raise ValueError("Sample rate must be in (0, 100%]")
+    return rate
+
 def performRender(args):
     # Download / update if requested
     if args.download:
@@ -316,23 +1019,56 @@ def performRender(args):
         args.outdir = "output"
     os.makedirs(args.outdir, exist_ok=True)
 
-    renderer = JSONHitRenderer(args.outdir, args.language, args.num_processes)
+    languages = args.languages.split(",") if args.languages else [args.language]
+    # All languages share one worker pool
+    executor = concurrent.futures.ThreadPoolExecutor(args.num_processes)
+
+    def submitLanguage(lang):
+        renderer = JSONHitRenderer(args.outdir, lang, executor=executor,
+                                   sample_rate=args.sample, rule_names=args.rule)
+        potDir = os.path.join("cache", lang)
+        xliffFiles = findXLIFFFiles(potDir, filt=args.filter, lang=lang)
+        if args.shard:
+            xliffFiles = shardXLIFFFiles(xliffFiles, *args.shard)
+        print(black("Reading {} files from {} folder...".format(len(xliffFiles), potDir), bold=True))
+        return renderer, renderer.submitRuleHits(xliffFiles)
 
-    # Import
-    potDir = os.path.join("cache", args.language)
-    xliffFiles = findXLIFFFiles(potDir, filt=args.filter)
-    print(black("Reading {} files from {} folder...".format(len(xliffFiles), potDir), bold=True))
-    # Compute hits
-    print(black("Computing rules...", bold=True))
-    renderer.computeRuleHitsForFileSet(xliffFiles)
+    # The files of the next language are submitted while the current one is
+    # collected and written, so the pool does not run dry between languages.
+    # At most two languages are kept in memory at a time.
+    nextLanguage = submitLanguage(languages[0])
+    for idx in range(len(languages)):
+        renderer, futures = nextLanguage
+        nextLanguage = submitLanguage(languages[idx + 1]) if idx + 1 < len(languages) else None
+        # Compute hits
+        print(black("Computing rules for {}...".format(renderer.lang), bold=True))
+        # Shards only collect the records of the corpus rules, see mergeShards()
+        renderer.collectRuleHits(futures, corpusHits=not args.shard)
+        # The results are stored in the renderer now
+        del futures
 
-    # Generate HTML
-    print(black("Rendering HTML...", bold=True))
-    renderer.exportHitsAsJSON()
+        # Partial results only, combined by render-merge
+        if args.shard:
+            print(black("Writing shard {}/{} for {}...".format(
+                args.shard[0], args.shard[1], renderer.lang), bold=True))
+            renderer.exportShard(*args.shard)
+            continue
 
-    # Generate filestats.json
-    print (black("Generating JSON API files...", bold=True))
-    renderer.writeStatsJSON()
+        # Only write the estimates. The hits of the sample must not
+        # replace the output of a full render (or be merged by --rule)
+        if args.sample:
+            print(black("Estimated hits for {} ({:g} % sample):".format(
+                renderer.lang, args.sample * 100), bold=True))
+            renderer.writeEstimates()
+            continue
+
+        # Generate HTML
+        print(black("Rendering HTML for {}...".format(renderer.lang), bold=True))
+        renderer.exportHitsAsJSON()
+
+        # Generate filestats.json
+        print (black("Generating JSON API files...", bold=True))
+        renderer.writeStatsJSON()
 
     # If data is present, generate subtitle information
     videosJSONPath = os.path.join("cache", "videos.json")
@@ -342,3 +1078,74 @@ def performRender(args):
             exercises = json.load(infile)
         subtitleTemplate = renderer.env.get_template("subtitles.html")
         writeToFile(os.path.join(args.outdir, "subtitles.html"), subtitleTemplate.render(exercises=exercises))
+
+def scanXLIFFMTimes(directory):
+    """
+    Get a filename => modification time map of all XLIFF files in the given directory
+    """
+    mtimes = {}
+    for (curdir, _, files) in os.walk(directory):
+        for f in files:
+            if f.endswith(".xliff"):
+                filename = os.path.join(curdir, f)
+                mtimes[filename] = os.stat(filename).st_mtime_ns
+    return mtimes
+
+def performWatch(args):
+    """
+    Render once and then keep re-rendering XLIFF files in cache/<lang> as they change.
+    Rules stay compiled and the worker pool stays alive between updates.
+    """
+    if not args.outdir:
+        args.outdir = "output"
+    os.makedirs(args.outdir, exist_ok=True)
+    languages = args.languages.split(",") if args.languages else [args.language]
+    executor = concurrent.futures.ThreadPoolExecutor(args.num_processes)
+    # Initial full render
+    watched = [] # (renderer, potDir, filename => mtime)
+    for lang in languages:
+        renderer = JSONHitRenderer(args.outdir, lang, executor=executor,
+                                   sample_rate=None, rule_names=None)
+        potDir = os.path.join("cache", lang)
+        mtimes = scanXLIFFMTimes(potDir)
+        xliffFiles = findXLIFFFiles(potDir, filt=args.filter, lang=lang)
+        print(black("Initial render of {} files for {}...".format(len(xliffFiles), lang), bold=True))
+        renderer.computeRuleHitsForFileSet(xliffFiles)
+        renderer.exportHitsAsJSON()
+        renderer.writeStatsJSON()
+        watched.append((renderer, potDir, mtimes))
+    # Poll for changes
+    print(black("Watching for changes every {} s...".format(args.interval), bold=True))
+    while True:
+        time.sleep(args.interval)
+        for idx, (renderer, potDir, oldMTimes) in enumerate(watched):
+            # Files may be removed or only partially written while we read them
+            try:
+                mtimes = scanXLIFFMTimes(potDir)
+                changed = [filename for filename, mtime in mtimes.items()
+                           if oldMTimes.get(filename) != mtime]
+                removed = [filename for filename in oldMTimes
+                           if filename not in mtimes and filename in renderer.files]
+                if not changed and not removed:
+                    continue
+                # Apply filter & filemap only to the changed files
+                xliffFiles = findXLIFFFiles(potDir, filt=args.filter, lang=renderer.lang)
+                changed = {filename: xliffFiles[filename] for filename in changed
+                           if filename in xliffFiles}
+                print(black("Updating {} changed and {} removed files for {}...".format(
+                    len(changed), len(removed), renderer.lang), bold=True))
+                renderer.updateFiles(changed, removed)
+            except (FileNotFoundError, XMLSyntaxError) as ex:
+                print(red("Update of {} failed, retrying: {}".format(renderer.lang, ex)))
+                continue
+            # Only after a successful update, so failed files are retried on the next poll
+            watched[idx] = (renderer, potDir, mtimes)
+
+def performRenderMerge(args):
+    if not args.outdir:
+        args.outdir = "output"
+    languages = args.languages.split(",") if args.languages else [args.language]
+    for lang in languages:
+        print(black("Merging {} shards for {}...".format(args.shards, lang), bold=True))
+        renderer = JSONHitRenderer(args.outdir, lang)
+        renderer.mergeShards(args.shards)
@@ -1,11 +1,12 @@
 #!/usr/bin/env python3
 from UpdateAllFiles import updateTranslations
-from check import performRender, performRenderLint
+from check import performRender, performRenderLint, performRenderMerge, performWatch, parseShard, parseSample
 from IMAPLint import updateLintIMAPHandler
 from VideoTranslations import updateVideoMap
 from PolyglottIndexer import buildPolyglottIndex
 from XLIFFReader import autotranslate_xliffs
 from game.GameServer import run_game_server
+from LintServer import run_lint_server
 
 if __name__ == "__main__":
     import argparse
@@ -32,7 +33,13 @@ if __name__ == "__main__":
     autotranslate.add_argument('-f', '--filter', nargs="*", action="append", help='Ignore file paths that do not contain this string, e.g. exercises or 2_high_priority. Can use multiple ones which are ANDed')
     autotranslate.add_argument('-i', '--index', action="store_true", help='Recognize and export patterns of different types')
     autotranslate.add_argument('-o', '--overwrite', action="store_true", help='Export suggestions where there is an existing (but not approved) suggestion')
+    indexMode = autotranslate.add_mutually_exclusive_group()
+    indexMode.add_argument('--single-pass', action="store_true", help='For --index, read every file only once, admitting patterns using a count-min sketch instead of a preindex pass')
+    indexMode.add_argument('--incremental', action="store_true", help='For --index, only re-index files which changed since the last --incremental run (per-file index in cache/index-<lang>)')
+    autotranslate.add_argument('--sketch-width', type=int, default=2**22, help='For --single-pass, number of counters per row of the count-min sketch')
+    autotranslate.add_argument('--max-pending', type=int, default=1000000, help='For --single-pass, maximum number of occurrences of not yet admitted patterns to keep in memory')
     autotranslate.add_argument('--index-ignore-translated', action="store_true", help='Ignore fully translated patterns')
+    autotranslate.add_argument('--result-cache', nargs='?', const='cache/autotranslate-results.sqlite', help='Store translation results (including untranslatable strings) on disk and reuse them in later runs and for other languages (default file: %(const)s). Not used with --full-auto')
     autotranslate.add_argument('--full-auto', action="store_true", help='Full-auto translation. USE SPARINGLY')
     autotranslate.add_argument('-l','--limit', type=int, default=1000000000, help='Number of string to translate using full auto mode')
     autotranslate.add_argument('--update-index-source', action="store_true", help='Update crowdin ka-babelfish source file for the index.')
@@ -48,15 +55,40 @@ if __name__ == "__main__":
     gameServer.add_argument('file', help='The file to read')
     gameServer.set_defaults(func=run_game_server)
 
+    lintServer = subparsers.add_parser('lint-server')
+    lintServer.add_argument('--languages', help='Comma-separated list of languages to load rules for (default: all)')
+    lintServer.add_argument('--host', default='localhost', help='The host to listen on')
+    lintServer.add_argument('-p', '--port', default=9923, type=int, help='The port to listen on')
+    lintServer.set_defaults(func=run_lint_server)
+
     render = subparsers.add_parser('render')
     render.add_argument('-j', '--num-processes', default=2, type=int, help='Number of threads to use for parallel processing')
     render.add_argument('-d', '--download', action='store_true', help='Download or update the directory')
     render.add_argument('-f', '--filter', nargs="*", action="append", help='Ignore file paths that do not contain this string, e.g. exercises or 2_high_priority. Can use multiple ones which are ANDed')
+    render.add_argument('--languages', help='Comma-separated list of languages to render in one process, e.g. de,sv-SE,hu (overrides -l)')
+    renderMode = render.add_mutually_exclusive_group()
+    renderMode.add_argument('--shard', type=parseShard, help='Only render shard i of n (e.g. 2/8) and write partial results for render-merge')
+    renderMode.add_argument('--rule', action='append', help='Only evaluate the rule with this machine name (repeatable). The results of all other rules are taken from the previous render in outdir')
+    renderMode.add_argument('--sample', type=parseSample, help='Only evaluate a random sample of the trans-units (e.g. 5%%) and write estimated hit counts to estimates.json')
     render.add_argument('--only-lint', action='store_true', help='Only render the lint hierarchy')
     render.add_argument('--no-lint', action='store_true', help='Do not render the lint hierarchy')
     render.add_argument('outdir', nargs='?', default=None, help='The output directory to use (default: output-<lang>)')
     render.set_defaults(func=performRender)
 
+    renderMerge = subparsers.add_parser('render-merge')
+    renderMerge.add_argument('-n', '--shards', type=int, required=True, help='Number of shards the render was split into')
+    renderMerge.add_argument('--languages', help='Comma-separated list of languages to merge (overrides -l)')
+    renderMerge.add_argument('outdir', nargs='?', default=None, help='The output directory to use (default: output)')
+    renderMerge.set_defaults(func=performRenderMerge)
+
+    watch = subparsers.add_parser('watch')
+    watch.add_argument('-j', '--num-processes', default=2, type=int, help='Number of threads to use for parallel processing')
+    watch.add_argument('-f', '--filter', nargs="*", action="append", help='Ignore file paths that do not contain this string, e.g. exercises or 2_high_priority. Can use multiple ones which are ANDed')
+    watch.add_argument('--languages', help='Comma-separated list of languages to watch (overrides -l)')
+    watch.add_argument('-i', '--interval', default=2.0, type=float, help='Polling interval in seconds')
+    watch.add_argument('outdir', nargs='?', default=None, help='The output directory to use (default: output)')
+    watch.set_defaults(func=performWatch)
+
     index = subparsers.add_parser('index')
     index.add_argument('-t', '--table', type=int, default=1, help='Table offset (where to store the data in YakDB. 1 => production setup)')
     index.set_defaults(func=buildPolyglottIndex)
@@ -28,6 +28,7 @@
 #
 import argparse, sys, re, codecs
 import polib
+from MappedInput import read_po_file
 
 def id_to_str(entry):
     """filter() function to determine if a given entry is untranslated"""
@@ -79,7 +80,7 @@ def find_untranslated_entries(infile, remove_context=False, tool="id_to_str"):
 
     Returns a string containing the resulting PO entries
     """
-    poentries = polib.pofile(infile)
+    poentries = read_po_file(infile)
     # Find untranslated strings
     untranslated = filter(filter_tools[tool], poentries)
     # Replace msgstr by msgid (because it would be empty otherwise due to POLib)
@@ -10,12 +10,6 @@ git pull
 ./katc.py -l hu update-translations -j 32
 ./katc.py -l cs update-translations -j 32
 
-# Render
-./katc.py -l de render -f 2_hig
-#./katc.py -l pt-BR render -f 2_high
-./katc.py -l bg render -f 2_high
-./katc.py -l hu render -f 2_high
-./katc.py -l cs render -f 2_high
-./katc.py -l sv-SE render -f 2_high
-./katc.py -l ja render -f 2_high
-./katc.py -l ka render -f 2_high
+# Render (all languages in one process)
+#  pt-BR currently disabled
+./katc.py render --languages de,bg,hu,cs,sv-SE,ja,ka -f 2_high